@@ -19,6 +19,16 @@ interface SegmentedImageProps {
 // Add axios default configuration
 axios.defaults.withCredentials = true;
 
+// Identifies this tab to the backend so textures prefetched after segmentation
+// can be matched to later requests, and dropped once the user leaves
+const sessionId = crypto.randomUUID();
+axios.defaults.headers.common['X-Session-Id'] = sessionId;
+window.addEventListener('pagehide', () => {
+  const body = new FormData();
+  body.append('sessionId', sessionId);
+  navigator.sendBeacon('http://localhost:5000/api/session/end', body);
+});
+
 const SegmentedImage = forwardRef<any, SegmentedImageProps>(({
   imageFile,
   onSegmentationComplete,
@@ -116,6 +126,7 @@ const SegmentedImage = forwardRef<any, SegmentedImageProps>(({
         segmentationData: segmentationData,
         textureDescription: texture.description,
         maskClass: mask.class,
+        textureId: texture.id, // Catalog textures are served from the generation cache
         segmentedParts: segmentedParts, // Add this structured data to the request
         prompt: texture.prompt || `Generate a seamless texture for ${mask.class} with these characteristics: ${texture.description}`
       }, {
@@ -136,7 +147,8 @@ const SegmentedImage = forwardRef<any, SegmentedImageProps>(({
             ...prev,
             [mask.class]: {
               texture: texture,
-              generatedTexture: response.data.generatedTexture
+              generatedTexture: response.data.generatedTexture,
+              tileable: response.data.tileable
             }
           };
           
@@ -146,6 +158,10 @@ const SegmentedImage = forwardRef<any, SegmentedImageProps>(({
         //drawSegmentation(hoveredClass); //called by useEffect
       }
     } catch (error) {
+      // 409: superseded by a newer click on the same mask, nothing to show
+      if (axios.isAxiosError(error) && error.response?.status === 409) {
+        return;
+      }
       console.error('Error generating texture:', error);
     }
   };
@@ -228,7 +244,14 @@ const SegmentedImage = forwardRef<any, SegmentedImageProps>(({
           // Apply clipping and draw the texture
           ctx.save();
           ctx.clip();
-          ctx.drawImage(textureImg, minX, minY, width, height);
+          const pattern = appliedTexture.tileable ? ctx.createPattern(textureImg, 'repeat') : null;
+          if (pattern) {
+            // Tileable textures repeat at their native size instead of being stretched
+            ctx.fillStyle = pattern;
+            ctx.fillRect(minX, minY, width, height);
+          } else {
+            ctx.drawImage(textureImg, minX, minY, width, height);
+          }
           ctx.restore();
           
           // Draw the outline again
@@ -104,6 +104,7 @@ function Home() {
         segmentationData: segmentationData,
         textureDescription: texture.description,
         maskClass: currentMask.class,
+        textureId: texture.id,
         prompt: texture.prompt || `Generate a seamless texture for ${currentMask.class} with these characteristics: ${texture.description}`
       }, {
         withCredentials: true,
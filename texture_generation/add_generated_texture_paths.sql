@@ -0,0 +1,2 @@
+-- Store where the pre-rendered Stable Diffusion output of each catalog texture lives
+ALTER TABLE textures ADD COLUMN IF NOT EXISTS generated_texture_path VARCHAR(255);
@@ -0,0 +1,107 @@
+import os
+import math
+import threading
+import metrics
+from scheduler import priority_rank, PREEMPT_MAX_PROGRESS
+
+# Longest a generate request should take, queueing included, and what happens
+# to requests expected to take longer: 'downgrade' retries them at the preview
+# tier and rejects them only if that is still too slow, 'reject' answers 503
+# straight away and 'off' admits everything
+GENERATION_SLA_SECONDS = float(os.getenv('GENERATION_SLA_SECONDS', '30'))
+ADMISSION_MODE = os.getenv('GENERATION_ADMISSION_MODE', 'downgrade')
+DOWNGRADE_TIER = 'preview'
+
+# Weight of the newest batch in the per-tier moving average of step time
+STEP_TIME_SMOOTHING = float(os.getenv('GENERATION_STEP_TIME_SMOOTHING', '0.2'))
+
+
+class StepTimes:
+    """Exponential moving average of the seconds one diffusion step of a batch takes, by tier."""
+
+    def __init__(self, smoothing=STEP_TIME_SMOOTHING):
+        self.smoothing = smoothing
+        self._averages = {}
+        self._lock = threading.Lock()
+
+    def record(self, tier, seconds, steps):
+        if steps <= 0:
+            return
+        sample = seconds / steps
+        with self._lock:
+            average = self._averages.get(tier)
+            self._averages[tier] = sample if average is None else average + self.smoothing * (sample - average)
+
+    def get(self, tier):
+        return self._averages.get(tier)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._averages)
+
+
+def job_steps(job):
+    """Denoising steps a job runs; img2img skips the first ``1 - strength`` of them."""
+    if job.mode == 'img2img' and job.strength:
+        return max(1, int(job.num_inference_steps * job.strength))
+    return job.num_inference_steps
+
+
+class AdmissionController:
+    """Estimates how long a new job would take and decides whether to queue it.
+
+    The estimate covers the rest of the running batch (unless the new job
+    would preempt it), every queued job that runs first, grouped into batches
+    the way the worker would run them, and the job itself, all priced with
+    the worker's per-tier moving averages of step time.
+    """
+
+    def __init__(self, worker, sla=GENERATION_SLA_SECONDS, mode=ADMISSION_MODE):
+        if mode not in ('downgrade', 'reject', 'off'):
+            raise ValueError(f"Unknown admission mode: {mode}")
+        self.worker = worker
+        self.sla = sla
+        self.mode = mode
+
+        metrics.register_gauge('generation_step_seconds', worker.step_times.snapshot)
+
+    def _run_seconds(self, job, steps=None):
+        step_seconds = self.worker.step_times.get(job.tier)
+        if step_seconds is None:
+            return None
+        return (steps if steps is not None else job_steps(job)) * step_seconds
+
+    def estimate_seconds(self, job):
+        """Expected seconds until ``job`` finishes if queued now, or None while its tier has no timings."""
+        total = self._run_seconds(job)
+        if total is None:
+            return None
+
+        batches = {}
+        for other in self.worker.queue.ahead_of(job):
+            batches.setdefault(other.batch_key(), []).append(other)
+        for jobs in batches.values():
+            runs = math.ceil(len(jobs) / self.worker.queue.max_batch_size)
+            total += runs * (self._run_seconds(jobs[0]) or 0.0)
+
+        running, progress = self.worker.running_batch()
+        if running:
+            preempts = progress < PREEMPT_MAX_PROGRESS and \
+                all(priority_rank(job.priority) < priority_rank(other.priority) for other in running)
+            if not preempts:
+                steps = job_steps(running[0])
+                total += self._run_seconds(running[0], steps * (1 - progress)) or 0.0
+        return total
+
+    def check(self, job):
+        """``('admit' | 'downgrade' | 'reject', estimated_seconds)`` for a new job."""
+        estimate = self.estimate_seconds(job)
+        if self.mode == 'off' or estimate is None or estimate <= self.sla:
+            return 'admit', estimate
+        if self.mode == 'downgrade' and job.tier != DOWNGRADE_TIER:
+            return 'downgrade', estimate
+        return 'reject', estimate
+
+    def retry_after(self, estimate):
+        """Seconds a rejected client should wait before trying again."""
+        return max(1, int(math.ceil(estimate - self.sla)))
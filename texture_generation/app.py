@@ -1,7 +1,10 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_file, send_from_directory, stream_with_context, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import os
+import json
+import time
+import hashlib
 from dotenv import load_dotenv
 import uuid
 from utils import process_image
@@ -9,7 +12,23 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import torch
 import diffusers
-from diffusers import StableDiffusionPipeline
+from generation import load_pipeline, catalog_job, default_seed, GenerationJob, GenerationWorker, JobCancelled, QUALITY_TIERS, TIER_BY_PRIORITY, JOB_TIMEOUT_SECONDS, MODEL_ID
+from previews import PREVIEW_EVERY
+from cache import GenerationCache, make_cache_key
+from embeddings import PromptEmbeddingCache
+import metrics
+from sizing import mask_bbox
+from prompts import canonicalize_prompt, canonical_template, log_prompt_request
+from recolor import recolor, parse_color, RECOLOR_MODES
+from prefetch import Prefetcher, PREFETCH_TOP_N
+from sessions import SessionJobs, SessionTextures
+from admission import AdmissionController, DOWNGRADE_TIER
+from residency import ModelResidency
+from dds import encode_dds, BC_FORMATS, BC_QUALITIES, BC_QUALITY
+from pbr import derive_pbr_maps, PBR_MAPS
+from atlas import pack_atlas, uv_rect, ATLAS_PADDING, ATLAS_MAX_PADDING
+from upscale import upscale_pool
+from composite import composite, encode_jpeg, DecodedImages, COMPOSITE_MODES
 import base64
 from io import BytesIO
 from PIL import Image
@@ -31,8 +50,8 @@ CORS(app,
          r"/*": {
              "origins": ["http://localhost:5173", "http://127.0.0.1:5173"],
              "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-             "allow_headers": ["Content-Type", "Authorization", "Access-Control-Allow-Origin"],
-             "expose_headers": ["Content-Range", "X-Content-Range"],
+             "allow_headers": ["Content-Type", "Authorization", "Access-Control-Allow-Origin", "X-Session-Id"],
+             "expose_headers": ["Content-Range", "X-Content-Range", "Retry-After"],
              "supports_credentials": True,
              "send_wildcard": False
          }
@@ -46,7 +65,7 @@ def after_request(response):
     origin = request.headers.get('Origin')
     if origin in ["http://localhost:5173", "http://127.0.0.1:5173"]:
         response.headers.add('Access-Control-Allow-Origin', origin)
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Session-Id')
         response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
         response.headers.add('Access-Control-Allow-Credentials', 'true')
         response.headers.add('Access-Control-Max-Age', '3600')
@@ -58,19 +77,18 @@ def after_request(response):
 def handle_options(path):
     return '', 204
 
-# Initialize Stable Diffusion pipeline
-model_id = "stabilityai/stable-diffusion-2-1"
-pipe = StableDiffusionPipeline.from_pretrained(
-    "runwayml/stable-diffusion-v1-5",
-    torch_dtype=torch.float16
-).to("cuda")
-
-# Move pipeline to GPU if available
-if torch.cuda.is_available():
-    print("Moving pipeline to GPU")
-    pipe = pipe.to("cuda")
-else:
-    print("CUDA is not available, using CPU")
+# Initialize Stable Diffusion pipeline and the worker that batches requests onto it
+pipe = load_pipeline()
+generation_cache = GenerationCache()
+embedding_cache = PromptEmbeddingCache(pipe, MODEL_ID)
+model_residency = ModelResidency(pipe)
+generation_worker = GenerationWorker(pipe, cache=generation_cache, embedding_cache=embedding_cache,
+                                     residency=model_residency).start()
+prefetcher = Prefetcher(generation_worker)
+session_jobs = SessionJobs(generation_worker)
+session_textures = SessionTextures()
+decoded_images = DecodedImages()
+admission = AdmissionController(generation_worker)
 
 # Configure rate limiting with more lenient limits for development
 limiter = Limiter(
@@ -143,6 +161,7 @@ class Texture(db.Model):
     negative_prompt = db.Column(db.Text, nullable=True)
     preview_image_path = db.Column(db.String(255), nullable=False)
     thumbnail_path = db.Column(db.String(255), nullable=False)
+    generated_texture_path = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
 
 # Routes
@@ -280,14 +299,32 @@ def segment_image():
     
     try:
         # Create a unique filename
-        unique_filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
+        upload_id = str(uuid.uuid4())
+        unique_filename = upload_id + '.' + file.filename.rsplit('.', 1)[1].lower()
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
         file.save(filepath)
         
         # Process the image
         result = process_image(filepath, save_debug_images=True)
+        save_segmentation(upload_id, unique_filename, result)
+        # Decode the photo for /api/composite in the background while the user
+        # picks textures
+        upscale_pool.submit(warm_decoded_photo, filepath)
         result['success'] = True
         result['image_path'] = os.path.join('uploads', unique_filename)
+        result['uploadId'] = upload_id
+
+        session_id = session_id_from_request()
+        session_textures.start_upload(session_id, upload_id)
+
+        # Start generating the textures the user is likely to browse next. This is
+        # only speculative, so a failure must not cost the user the segmentation.
+        if session_id:
+            try:
+                queued = prefetcher.prefetch(session_id, prefetch_jobs(result['material_categories']))
+                print(f"Prefetching {queued} texture(s) for session {session_id}")
+            except Exception as e:
+                print("Error prefetching textures:", str(e))
         
         return jsonify(result)
         
@@ -297,105 +334,820 @@ def segment_image():
             'error': str(e)
         }), 500
 
+def warm_decoded_photo(path):
+    """Decode an uploaded photo into ``decoded_images`` ahead of its first composite.
+
+    This is only speculative: a failure is logged and the composite decodes
+    the photo itself.
+    """
+    try:
+        decoded_images.get(path, file_digest(path))
+    except Exception as e:
+        print("Error decoding photo for compositing:", str(e))
+
+def segmentation_path(upload_id):
+    # Upload ids are UUIDs; parsing them also keeps the path inside the upload folder
+    return os.path.join(app.config['UPLOAD_FOLDER'], f'{uuid.UUID(upload_id)}.json')
+
+def save_segmentation(upload_id, filename, result):
+    """Keep the masks of an upload next to it, so later requests can refer to it by id."""
+    with open(segmentation_path(upload_id), 'w') as f:
+        json.dump({
+            'image': filename,
+            'width': result['width'],
+            'height': result['height'],
+            'masks': result['masks']
+        }, f)
+
+def load_upload(upload_id):
+    """Photo path and segmentation of an upload, by the id /api/segment returned."""
+    try:
+        path = segmentation_path(upload_id)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError('Invalid uploadId')
+    if not os.path.exists(path):
+        raise FileNotFoundError('Upload not found')
+    with open(path) as f:
+        segmentation = json.load(f)
+    return os.path.join(app.config['UPLOAD_FOLDER'], segmentation['image']), segmentation
+
+def build_generation_job(data, **job_kwargs):
+    """Validate a generate-texture request body and build its generation job.
+
+    Returns ``(job, None)`` on success or ``(None, (response, status))`` when the
+    request is invalid.
+    """
+    if not data or 'segmentationData' not in data or 'maskClass' not in data:
+        print("Missing required data:", {
+            'has_data': bool(data),
+            'has_segmentationData': 'segmentationData' in data if data else False,
+            'has_maskClass': 'maskClass' in data if data else False
+        })
+        return None, (jsonify({
+            'success': False,
+            'error': 'Missing required data'
+        }), 400)
+
+    # Get the mask data for the specific class
+    mask_data = None
+    for mask in data['segmentationData']['masks']:
+        if mask['class'] == data['maskClass']:
+            mask_data = mask
+            break
+
+    if not mask_data:
+        print("Mask not found for class:", data['maskClass'])
+        return None, (jsonify({
+            'success': False,
+            'error': 'Mask not found'
+        }), 404)
+
+    # Catalog textures are generated with a pinned seed, so they are served from the cache
+    texture = None
+    if data.get('textureId') is not None:
+        texture = Texture.query.get(data['textureId'])
+        if not texture:
+            return None, (jsonify({
+                'success': False,
+                'error': 'Texture not found'
+            }), 404)
+
+    # Get prompt from either texture object or direct prompt. Free-form prompts are
+    # canonicalized so wording variants of the same intent share a cache entry.
+    prompt = data.get('prompt')
+    if prompt:
+        prompt = canonicalize_prompt(prompt)
+    elif 'textureDescription' in data:
+        prompt = canonical_template(data['maskClass'], data['textureDescription'])
+
+    if not prompt and not texture:
+        print("No prompt available")
+        return None, (jsonify({
+            'success': False,
+            'error': 'No prompt available for texture generation'
+        }), 400)
+
+    # Optional quality tier; defaults to the tier for interactive requests
+    tier = data.get('tier')
+    if tier is not None and tier not in QUALITY_TIERS:
+        return None, (jsonify({
+            'success': False,
+            'error': f"Unknown tier '{tier}', expected one of: {', '.join(QUALITY_TIERS)}"
+        }), 400)
+
+    # Tileable textures repeat seamlessly, so small tiles can cover large masks
+    tileable = bool(data.get('tileable', False))
+
+    # Optional seed. Without one the result is still reproducible: catalog textures
+    # use their pinned seed and prompts a seed derived from the prompt.
+    seed = data.get('seed')
+    if seed is not None:
+        if isinstance(seed, bool) or not isinstance(seed, int) or not 0 <= seed < 2 ** 32:
+            return None, (jsonify({
+                'success': False,
+                'error': 'seed must be an integer between 0 and 4294967295'
+            }), 400)
+        job_kwargs['seed'] = seed
+
+    if texture:
+        print("Using catalog texture:", texture.id)
+        job = catalog_job(texture, tier=tier, tileable=tileable, **job_kwargs)
+    else:
+        print("Using prompt:", prompt)
+        job_kwargs.setdefault('seed', default_seed(prompt))
+        job = GenerationJob(
+            prompt=prompt,
+            negative_prompt="blurry, low quality, distorted, unrealistic",
+            tier=tier,
+            tileable=tileable,
+            **job_kwargs
+        )
+
+    log_prompt_request(data, job.prompt)
+
+    # Size the render from the mask's bounding box. Catalog textures default to
+    # their pre-rendered square tile so they stay cache hits.
+    if data.get('fitMask', texture is None):
+        min_x, min_y, max_x, max_y = mask_bbox(mask_data['points'])
+        job.fit_to_region(max_x - min_x, max_y - min_y)
+
+    # Variants start from a cached texture of the same category and only run a
+    # few img2img steps; without a cached base they fall back to text-to-image
+    if data.get('variant'):
+        key = job.cache_key()
+        if not (key and generation_cache.get(key)):
+            base_path = find_variant_base(texture, data['maskClass'])
+            if base_path:
+                print("Generating variant from:", base_path)
+                metrics.increment('variant_jobs')
+                job.as_variant(Image.open(base_path), base_key=os.path.basename(base_path))
+            else:
+                metrics.increment('variant_fallbacks')
+    return job, None
+
+def find_variant_base(texture, mask_class):
+    """Path of a cached texture in the same category to start a variant from."""
+    if texture:
+        category = texture.category
+    else:
+        category = TextureCategory.query.filter(TextureCategory.name.ilike(mask_class)).first()
+    if not category:
+        return None
+
+    for candidate in category.textures:
+        if texture and candidate.id == texture.id:
+            continue
+        if candidate.generated_texture_path and os.path.exists(candidate.generated_texture_path):
+            return candidate.generated_texture_path
+        cached_path = generation_cache.get(catalog_job(candidate).cache_key())
+        if cached_path:
+            return cached_path
+    return None
+
+def png_data_url(image):
+    """Encode an image as a base64 PNG data URL."""
+    buffered = BytesIO()
+    image.save(buffered, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffered.getvalue()).decode()
+
+def mip_levels(manifest):
+    """Mip levels of a manifest with their files as URLs."""
+    return [
+        dict(level, **{fmt: url_for('texture_file', path=level[fmt], _external=True)
+                       for fmt in ('png', 'webp') if fmt in level})
+        for level in manifest['levels']
+    ]
+
+def texture_result(job, image):
+    """Build the response payload for a finished generation job.
+
+    Large textures are written to disk by the worker without an in-memory
+    image (``image`` is None); those are returned as a URL instead of inline.
+    """
+    texture_path = job.cache_path
+    if image is None:
+        with Image.open(texture_path) as stored:
+            width, height = stored.size
+        img_str = url_for('texture_file', path=texture_path, _external=True)
+    else:
+        width, height = image.size
+        # Convert the generated image to base64
+        img_str = png_data_url(image)
+
+        # Save the generated texture unless it already lives in the generation cache
+        if not texture_path:
+            unique_id = str(uuid.uuid4())
+            texture_path = os.path.join('static', 'generated_textures', f'{unique_id}.png')
+            os.makedirs(os.path.dirname(texture_path), exist_ok=True)
+            image.save(texture_path)
+
+    return {
+        'success': True,
+        'generatedTexture': img_str,
+        'texturePath': texture_path,
+        'tier': job.tier,
+        'tileable': job.tileable,
+        'mode': job.mode,
+        'seed': job.seed,
+        'mips': mip_levels(job.mips) if job.mips else None,
+        'dds': url_for('texture_dds', texturePath=texture_path, _external=True),
+        'width': width,
+        'height': height,
+        'timings': job.timings
+    }
+
+def session_id_from_request():
+    """Client session token sent by the frontend, if any."""
+    return request.headers.get('X-Session-Id') or request.values.get('sessionId')
+
+def admit_job(data, job, **job_kwargs):
+    """Admission control for a new generate request.
+
+    Requests the worker is not expected to finish within the SLA are rebuilt
+    at the preview tier or refused. Returns ``(job, None)`` or
+    ``(None, (response, status))`` like ``build_generation_job``.
+    """
+    # Cache hits and prefetched jobs cost the pipeline nothing new
+    key = job.cache_key()
+    if (key and generation_cache.get(key)) or prefetcher.has(session_id_from_request(), job):
+        return job, None
+
+    decision, estimate = admission.check(job)
+    if decision == 'downgrade':
+        print(f"Downgrading request to {DOWNGRADE_TIER}, estimated {estimate:.1f}s")
+        metrics.increment('admission_downgraded')
+        job, error = build_generation_job(dict(data, tier=DOWNGRADE_TIER), **job_kwargs)
+        if error:
+            return None, error
+        decision, estimate = admission.check(job)
+    if decision != 'reject':
+        return job, None
+
+    print(f"Rejecting request, estimated {estimate:.1f}s")
+    metrics.increment('admission_rejected')
+    retry_after = admission.retry_after(estimate)
+    response = jsonify({
+        'success': False,
+        'error': 'Texture generation is overloaded, please try again later',
+        'retryAfter': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return None, (response, 503)
+
+def submit_job(job):
+    """Queue a job, joining this session's prefetched job for the same texture if there is one."""
+    prefetched = prefetcher.claim(session_id_from_request(), job)
+    return prefetched or generation_worker.submit(job)
+
+def prefetch_jobs(material_categories):
+    """Catalog jobs for the first textures of each detected material category."""
+    jobs = []
+    for category in material_categories:
+        textures = Texture.query.join(TextureCategory) \
+            .filter(TextureCategory.name.ilike(category['name'])) \
+            .order_by(Texture.id) \
+            .limit(PREFETCH_TOP_N) \
+            .all()
+        # Same settings as a catalog click so the click finds the result
+        jobs.extend(catalog_job(texture, tier=TIER_BY_PRIORITY['interactive'], priority='prefetch')
+                    for texture in textures)
+    return jobs
+
+@app.route('/api/session/end', methods=['POST'])
+def end_session():
+    """Called by the frontend when the user leaves, so queued prefetches and running jobs are dropped."""
+    session_id = session_id_from_request() or (request.get_json(silent=True) or {}).get('sessionId')
+    if session_id:
+        prefetcher.end_session(session_id)
+        session_jobs.end_session(session_id)
+        session_textures.end_session(session_id)
+    return '', 204
+
 @app.route('/api/generate-texture', methods=['POST'])
 def generate_texture():
     try:
         data = request.json
         print("Received request data:", data)
-        
-        if not data or 'segmentationData' not in data or 'maskClass' not in data:
-            print("Missing required data:", {
-                'has_data': bool(data),
-                'has_segmentationData': 'segmentationData' in data if data else False,
-                'has_maskClass': 'maskClass' in data if data else False
-            })
+
+        job, error = build_generation_job(data)
+        if error:
+            return error
+        job, error = admit_job(data, job)
+        if error:
+            return error
+
+        # Queue the job; concurrent requests with the same settings share one batched call.
+        # A later request for the same mask from this session cancels it.
+        job = submit_job(job)
+        session_id = session_id_from_request()
+        session_jobs.track(session_id, data['maskClass'], job)
+        try:
+            image = job.wait()
+        finally:
+            session_jobs.release(session_id, data['maskClass'], job)
+
+        print("Generated image:", image)
+
+        response = texture_result(job, image)
+        session_textures.apply(session_id, data['maskClass'], response['texturePath'])
+        print("Sending response:", response)
+        return jsonify(response)
+
+    except JobCancelled as e:
+        return jsonify({
+            'success': False,
+            'cancelled': True,
+            'error': str(e)
+        }), 409
+    except Exception as e:
+        print("Error in generate_texture:", str(e))
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/generate-texture/stream', methods=['POST'])
+def generate_texture_stream():
+    """Generate a texture and stream low-res previews as Server-Sent Events.
+
+    Emits ``preview`` events every ``previewEvery`` steps, then one ``result``
+    event with the same payload as /api/generate-texture (or an ``error`` event).
+    """
+    data = request.json
+    print("Received stream request data:", data)
+
+    try:
+        preview_every = max(1, int(data.get('previewEvery', PREVIEW_EVERY))) if data else PREVIEW_EVERY
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'error': 'previewEvery must be an integer'
+        }), 400
+
+    try:
+        job, error = build_generation_job(data, preview_every=preview_every)
+        if error:
+            return error
+        job, error = admit_job(data, job, preview_every=preview_every)
+        if error:
+            return error
+        job = submit_job(job)
+        session_id = session_id_from_request()
+        session_jobs.track(session_id, data['maskClass'], job)
+    except Exception as e:
+        print("Error in generate_texture_stream:", str(e))
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+    def events():
+        try:
+            # A joined prefetch job has no preview stream; it only sends the result
+            while job.previews is not None:
+                preview = job.previews.get(timeout=JOB_TIMEOUT_SECONDS)
+                if preview is None:
+                    break
+                yield sse_event('preview', preview)
+
+            image = job.wait()
+            result = texture_result(job, image)
+            session_textures.apply(session_id, data['maskClass'], result['texturePath'])
+            if job.started_at:
+                # Share of the run spent decoding previews
+                result['previewOverhead'] = job.preview_seconds / max(job.finished_at - job.started_at, 1e-6)
+            yield sse_event('result', result)
+        except Exception as e:
+            print("Error in generate_texture_stream:", str(e))
+            yield sse_event('error', {'success': False, 'error': str(e)})
+        finally:
+            # Also reached when the client disconnects mid-stream; stop generating for it
+            session_jobs.release(session_id, data['maskClass'], job)
+            generation_worker.cancel(job)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def texture_roots():
+    """Directories texture files may be read from."""
+    return [
+        os.path.realpath(os.path.join('static', 'generated_textures')),
+        os.path.realpath(generation_cache.root),
+        os.path.realpath(os.path.join(app.static_folder, 'textures'))
+    ]
+
+def resolve_texture_file(texture_id=None, texture_path=None):
+    """Local file of a catalog texture or a previously generated texture.
+
+    Catalog textures use their generated render when there is one and their
+    preview image otherwise. Paths outside the texture directories are refused.
+    """
+    if texture_id is not None:
+        texture = Texture.query.get(texture_id)
+        if not texture:
+            raise FileNotFoundError('Texture not found')
+        if texture.generated_texture_path and os.path.exists(texture.generated_texture_path):
+            texture_path = texture.generated_texture_path
+        else:
+            texture_path = os.path.join(app.static_folder, texture.preview_image_path.lstrip('/'))
+    if not texture_path:
+        raise ValueError('Missing textureId or texturePath')
+
+    path = os.path.realpath(texture_path)
+    if not any(os.path.commonpath([path, root]) == root for root in texture_roots()):
+        raise ValueError('Invalid texturePath')
+    if not os.path.exists(path):
+        raise FileNotFoundError('Texture file not found')
+    return path
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+@app.route('/api/recolor-texture', methods=['POST'])
+def recolor_texture():
+    """Recolor an existing texture on the CPU instead of running Stable Diffusion.
+
+    Body: ``textureId`` or ``texturePath``, plus ``color`` ('#rrggbb') or
+    ``palette`` (list of colors), and optional ``mode`` ('transfer' or 'tint').
+    """
+    data = request.json or {}
+    try:
+        start = time.perf_counter()
+        source_path = resolve_texture_file(data.get('textureId'), data.get('texturePath'))
+
+        colors = data.get('palette') or ([data['color']] if data.get('color') else None)
+        if not colors:
             return jsonify({
                 'success': False,
-                'error': 'Missing required data'
+                'error': 'Missing color or palette'
             }), 400
+        colors = [parse_color(color) for color in colors]
+        mode = data.get('mode', 'transfer')
+        if mode not in RECOLOR_MODES:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown mode '{mode}', expected one of: {', '.join(RECOLOR_MODES)}"
+            }), 400
+
+        # Recolored textures are cached like generated ones, keyed by the source content
+        key = make_cache_key(op='recolor', source=file_digest(source_path), colors=colors, mode=mode)
+        texture_path = generation_cache.get(key)
+        metrics.increment('recolor_requests')
+        if texture_path:
+            metrics.increment('recolor_cache_hits')
+            image = Image.open(texture_path).convert('RGB')
+        else:
+            image = recolor(Image.open(source_path), colors, mode)
+            texture_path = generation_cache.put(key, image)
+        if data.get('maskClass'):
+            session_textures.apply(session_id_from_request(), data['maskClass'], texture_path)
+
+        return jsonify({
+            'success': True,
+            'generatedTexture': png_data_url(image),
+            'texturePath': texture_path,
+            'mode': mode,
+            'width': image.width,
+            'height': image.height,
+            'timings': {'recolor': time.perf_counter() - start}
+        })
+    except FileNotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        print("Error in recolor_texture:", str(e))
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-        # Get the mask data for the specific class
-        mask_data = None
-        for mask in data['segmentationData']['masks']:
-            if mask['class'] == data['maskClass']:
-                mask_data = mask
-                break
+@app.route('/api/texture-dds')
+def texture_dds():
+    """Block-compressed DDS of a catalog or generated texture, with a full mip chain.
 
-        if not mask_data:
-            print("Mask not found for class:", data['maskClass'])
+    Query: ``textureId`` or ``texturePath``, plus optional ``format`` ('bc1' or
+    'bc3') and ``quality`` ('fast' or 'high'). Encoded files are cached by the
+    source content, so each texture is only compressed once.
+    """
+    try:
+        source_path = resolve_texture_file(request.args.get('textureId', type=int), request.args.get('texturePath'))
+        fmt = request.args.get('format', 'bc1')
+        quality = request.args.get('quality', BC_QUALITY)
+        if fmt not in BC_FORMATS:
             return jsonify({
                 'success': False,
-                'error': 'Mask not found'
-            }), 404
+                'error': f"Unknown format '{fmt}', expected one of: {', '.join(BC_FORMATS)}"
+            }), 400
+        if quality not in BC_QUALITIES:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown quality '{quality}', expected one of: {', '.join(BC_QUALITIES)}"
+            }), 400
+
+        key = make_cache_key(op='dds', source=file_digest(source_path), format=fmt, quality=quality)
+        dds_path = generation_cache.get(key, 'dds')
+        metrics.increment('dds_requests')
+        if dds_path:
+            metrics.increment('dds_cache_hits')
+        else:
+            start = time.perf_counter()
+            with Image.open(source_path) as image:
+                data = encode_dds(image, fmt, quality)
+            dds_path = generation_cache.put_bytes(key, data, 'dds')
+            metrics.increment('dds_encode_seconds', time.perf_counter() - start)
+
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        return send_file(dds_path, mimetype='image/vnd-ms.dds', download_name=f'{name}.{fmt}.dds')
+    except FileNotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        print("Error in texture_dds:", str(e))
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/material')
+def material_bundle():
+    """PBR material of a catalog or generated texture: albedo plus derived maps.
 
-        # Get prompt from either texture object or direct prompt
-        prompt = data.get('prompt')
-        if not prompt and 'textureDescription' in data:
-            prompt = f"Generate a seamless texture for {data['maskClass']} with the following characteristics: {data['textureDescription']}"
+    Query: ``textureId`` or ``texturePath``, and ``tileable`` for textures that
+    repeat. Height, normal, roughness and AO maps are derived from the albedo
+    on the CPU and cached with it, keyed by the albedo's content.
+    """
+    try:
+        start = time.perf_counter()
+        source_path = resolve_texture_file(request.args.get('textureId', type=int), request.args.get('texturePath'))
+        tileable = request.args.get('tileable', 'false').lower() == 'true'
+
+        key = make_cache_key(op='pbr', source=file_digest(source_path), tileable=tileable)
+        bundle = generation_cache.get_json(key)
+        metrics.increment('material_requests')
+        if bundle:
+            metrics.increment('material_cache_hits')
+        else:
+            with Image.open(source_path) as image:
+                maps = derive_pbr_maps(image, tileable=tileable)
+            bundle = {name: generation_cache.put(f'{key}-{name}', maps[name]) for name in PBR_MAPS}
+            generation_cache.put_json(key, bundle)
 
-        if not prompt:
-            print("No prompt available")
+        return jsonify({
+            'success': True,
+            'textureId': request.args.get('textureId', type=int),
+            'tileable': tileable,
+            'maps': dict(
+                albedo=url_for('texture_file', path=source_path, _external=True),
+                **{name: url_for('texture_file', path=path, _external=True) for name, path in bundle.items()}
+            ),
+            'timings': {'material': time.perf_counter() - start}
+        })
+    except FileNotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        print("Error in material_bundle:", str(e))
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/atlas')
+def texture_atlas():
+    """Pack the textures applied to this session's masks into one atlas.
+
+    Returns the atlas URL and each mask's UV rectangle (v from the top).
+    Atlases are cached by the set of texture contents, so masks sharing a
+    texture share a rectangle and re-requesting the same set is free.
+    """
+    session_id = session_id_from_request()
+    applied = session_textures.get(session_id)
+    if not applied:
+        return jsonify({
+            'success': False,
+            'error': 'No textures applied in this session'
+        }), 404
+
+    try:
+        start = time.perf_counter()
+        padding = request.args.get('padding', ATLAS_PADDING, type=int)
+        if not 0 <= padding <= ATLAS_MAX_PADDING:
             return jsonify({
                 'success': False,
-                'error': 'No prompt available for texture generation'
+                'error': f'padding must be between 0 and {ATLAS_MAX_PADDING}'
             }), 400
+        digests = {mask: file_digest(resolve_texture_file(texture_path=path)) for mask, path in applied.items()}
+        unique = sorted(set(digests.values()))
 
-        print("Using prompt:", prompt)
+        key = make_cache_key(op='atlas', textures=unique, padding=padding)
+        layout = generation_cache.get_json(key)
+        metrics.increment('atlas_requests')
+        if layout:
+            metrics.increment('atlas_cache_hits')
+        else:
+            paths = {digest: resolve_texture_file(texture_path=applied[mask]) for mask, digest in digests.items()}
+            images = [Image.open(paths[digest]) for digest in unique]
+            atlas, rects = pack_atlas(images, padding=padding)
+            layout = {
+                'path': generation_cache.put(key, atlas),
+                'width': atlas.width,
+                'height': atlas.height,
+                'rects': dict(zip(unique, rects))
+            }
+            generation_cache.put_json(key, layout)
 
-        pipe = StableDiffusionPipeline.from_pretrained(
-        "runwayml/stable-diffusion-v1-5",
-        torch_dtype=torch.float16
-    ).to("cuda")
-        
-        # Generate texture using Stable Diffusion with GPU
-        with torch.no_grad():
-            if torch.cuda.is_available():
-                print("Generating texture on GPU")
-                # Move input tensors to GPU
-                pipe = pipe.to("cuda")
-            else:
-                print("Warning: Generating texture on CPU - this will be slow")
-            
-            image = pipe(
-                prompt=prompt,
-                negative_prompt="blurry, low quality, distorted, unrealistic",
-                num_inference_steps=30,
-                guidance_scale=7.5
-            ).images[0]
-
-            # Move pipeline back to CPU to free GPU memory
-            if torch.cuda.is_available():
-                pipe = pipe.to("cpu")
-                torch.cuda.empty_cache()
+        size = (layout['width'], layout['height'])
+        return jsonify({
+            'success': True,
+            'atlas': url_for('texture_file', path=layout['path'], _external=True),
+            'atlasPath': layout['path'],
+            'width': layout['width'],
+            'height': layout['height'],
+            'uvs': {mask: uv_rect(layout['rects'][digest], size) for mask, digest in digests.items()},
+            'timings': {'atlas': time.perf_counter() - start}
+        })
+    except FileNotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        print("Error in texture_atlas:", str(e))
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-        print("Generated image:", image)
+def composite_layers(textures):
+    """Normalize a ``{mask: texture}`` map of a composite request.
 
-        # Convert the generated image to base64
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+    Each texture is a ``texturePath`` string or an object with ``textureId`` or
+    ``texturePath`` and optional ``tileable``. Returns ``{mask: (path, tileable)}``.
+    """
+    if not isinstance(textures, dict):
+        raise ValueError('textures must map mask classes to textures')
+    layers = {}
+    for mask, texture in textures.items():
+        if isinstance(texture, str):
+            texture = {'texturePath': texture}
+        if not isinstance(texture, dict):
+            raise ValueError(f"Invalid texture for mask '{mask}'")
+        path = resolve_texture_file(texture.get('textureId'), texture.get('texturePath'))
+        layers[mask] = (path, bool(texture.get('tileable', False)))
+    return layers
 
-        # Save the generated texture
-        unique_id = str(uuid.uuid4())
-        texture_path = os.path.join('static', 'generated_textures', f'{unique_id}.png')
-        os.makedirs(os.path.dirname(texture_path), exist_ok=True)
-        image.save(texture_path)
+@app.route('/api/composite', methods=['POST'])
+def composite_image():
+    """Render textures into the segmented photo and return the finished frame.
 
-        response = {
-            'success': True,
-            'generatedTexture': f"data:image/png;base64,{img_str}",
-            'texturePath': texture_path
-        }
-        print("Sending response:", response)
-        return jsonify(response)
+    Body: ``uploadId`` (defaults to this session's last upload), ``textures``
+    mapping mask classes to textures (defaults to the textures applied in this
+    session), optional ``alpha`` (0-1) and ``mode``: 'blend' pastes textures
+    as they are, 'shade' keeps the photo's lighting on them. Composites are
+    cached by the photo, its masks, the texture contents and the options.
+    """
+    data = request.json or {}
+    try:
+        start = time.perf_counter()
+        session_id = session_id_from_request()
+        upload_id = data.get('uploadId') or session_textures.upload(session_id)
+        if not upload_id:
+            return jsonify({
+                'success': False,
+                'error': 'Missing uploadId'
+            }), 400
+        photo_path, segmentation = load_upload(upload_id)
+
+        textures = data.get('textures')
+        layers = composite_layers(textures if textures is not None else session_textures.get(session_id))
+        try:
+            alpha = float(data.get('alpha', 1.0))
+        except (TypeError, ValueError):
+            raise ValueError('alpha must be a number between 0 and 1')
+        if not 0 <= alpha <= 1:
+            raise ValueError('alpha must be a number between 0 and 1')
+        mode = data.get('mode', 'blend')
+        if mode not in COMPOSITE_MODES:
+            raise ValueError(f"Unknown mode '{mode}', expected one of: {', '.join(COMPOSITE_MODES)}")
 
+        photo_digest = file_digest(photo_path)
+        digests = {path: file_digest(path) for path, _ in layers.values()}
+        key = make_cache_key(
+            op='composite',
+            photo=photo_digest,
+            segmentation=file_digest(segmentation_path(upload_id)),
+            textures={mask: [digests[path], tileable] for mask, (path, tileable) in layers.items()},
+            alpha=alpha,
+            mode=mode
+        )
+        timings = {}
+        composite_path = generation_cache.get(key, 'jpg')
+        metrics.increment('composite_requests')
+        if composite_path:
+            metrics.increment('composite_cache_hits')
+        else:
+            decode_start = time.perf_counter()
+            # Writable copy, the textures are painted into it in place
+            photo = decoded_images.get(photo_path, photo_digest).copy()
+            pixels = {path: decoded_images.get(path, digest) for path, digest in digests.items()}
+            # Polygons are drawn in segmentation order, like the frontend canvas
+            polygons = []
+            for mask in segmentation['masks']:
+                if mask['class'] in layers:
+                    path, tileable = layers[mask['class']]
+                    polygons.append((mask['points'], pixels[path], tileable))
+            render_start = time.perf_counter()
+            out = composite(photo, polygons, alpha, mode)
+            encode_start = time.perf_counter()
+            composite_path = generation_cache.put_bytes(key, encode_jpeg(out), 'jpg')
+            timings = {
+                'decode': render_start - decode_start,
+                'render': encode_start - render_start,
+                'encode': time.perf_counter() - encode_start
+            }
+            metrics.increment('composite_render_seconds', timings['render'])
+        timings['total'] = time.perf_counter() - start
+
+        return jsonify({
+            'success': True,
+            'uploadId': upload_id,
+            'mode': mode,
+            'image': url_for('texture_file', path=composite_path, _external=True),
+            'imagePath': composite_path,
+            'width': segmentation['width'],
+            'height': segmentation['height'],
+            'timings': timings
+        })
+    except FileNotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
-        print("Error in generate_texture:", str(e))
+        print("Error in composite_image:", str(e))
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/api/texture-file')
+def texture_file():
+    """Serve a generated texture by its ``texturePath``; used for outputs too large to inline."""
+    try:
+        return send_file(resolve_texture_file(texture_path=request.args.get('path')))
+    except FileNotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@app.route('/api/metrics')
+def get_metrics():
+    return jsonify({
+        'success': True,
+        'data': metrics.snapshot()
+    })
+
 # Serve uploaded files
 @app.route('/static/uploads/<path:filename>')
 def serve_upload(filename):
@@ -0,0 +1,128 @@
+import os
+import numpy as np
+from PIL import Image
+
+# Pixels of replicated border around each packed texture, so bilinear and mip
+# sampling near a rectangle's edge never pick up its neighbour
+ATLAS_PADDING = int(os.getenv('GENERATION_ATLAS_PADDING', '4'))
+# Largest padding a request may ask for
+ATLAS_MAX_PADDING = 64
+ATLAS_MAX_SIZE = int(os.getenv('GENERATION_ATLAS_MAX_SIZE', '4096'))
+
+
+def skyline_pack(sizes, width):
+    """Bottom-left skyline packing of ``(w, h)`` rectangles into a strip ``width`` wide.
+
+    Rectangles are placed tallest first, each at the lowest (then leftmost)
+    spot on the skyline. Returns the ``(x, y)`` of every rectangle in input
+    order and the height used, or None if a rectangle is wider than the strip.
+    """
+    skyline = [(0, 0, width)]  # (x, y, width) segments, left to right
+    positions = [None] * len(sizes)
+    for index in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        rect_width, rect_height = sizes[index]
+        best = None
+        for start, (x, _, _) in enumerate(skyline):
+            if x + rect_width > width:
+                break
+            # The rectangle rests on the highest segment it spans
+            y, covered, j = 0, 0, start
+            while covered < rect_width:
+                y = max(y, skyline[j][1])
+                covered += skyline[j][2]
+                j += 1
+            if best is None or (y, x) < best:
+                best = (y, x)
+        if best is None:
+            return None
+
+        y, x = best
+        positions[index] = (x, y)
+        updated = []
+        for seg_x, seg_y, seg_width in skyline:
+            seg_end = seg_x + seg_width
+            if seg_end <= x or seg_x >= x + rect_width:
+                updated.append((seg_x, seg_y, seg_width))
+                continue
+            if seg_x < x:
+                updated.append((seg_x, seg_y, x - seg_x))
+            if seg_end > x + rect_width:
+                updated.append((x + rect_width, seg_y, seg_end - x - rect_width))
+        updated.append((x, y + rect_height, rect_width))
+        updated.sort()
+
+        # Merge neighbouring segments at the same height
+        skyline = [updated[0]]
+        for seg in updated[1:]:
+            last = skyline[-1]
+            if seg[1] == last[1]:
+                skyline[-1] = (last[0], last[1], last[2] + seg[2])
+            else:
+                skyline.append(seg)
+
+    height = max(y + sizes[i][1] for i, (_, y) in enumerate(positions)) if sizes else 0
+    return positions, height
+
+
+def choose_layout(sizes, max_size=ATLAS_MAX_SIZE):
+    """Smallest packing of ``sizes`` over power-of-two widths, as ``(width, height, positions)``."""
+    widest = max(width for width, _ in sizes)
+    best = None
+    width = 1 << (max(widest, 1) - 1).bit_length()
+    while width <= max_size:
+        packed = skyline_pack(sizes, width)
+        if packed:
+            positions, height = packed
+            # Keep heights on multiples of 4 so the atlas block-compresses cleanly
+            height += -height % 4
+            if height <= max_size:
+                score = (width * height, max(width, height))
+                if best is None or score < best[0]:
+                    best = (score, width, height, positions)
+        width *= 2
+    return best[1:] if best else None
+
+
+def pack_atlas(images, padding=ATLAS_PADDING, max_size=ATLAS_MAX_SIZE):
+    """Pack PIL images into one RGB atlas.
+
+    Returns the atlas and, for every input image, its pixel rectangle
+    ``(x, y, width, height)`` without padding. Textures are scaled down
+    together, by halves, until the layout fits in ``max_size``. Raises
+    ValueError if not even 1px textures fit.
+    """
+    scale = 1.0
+    while True:
+        sizes = [(max(1, int(image.width * scale)), max(1, int(image.height * scale))) for image in images]
+        padded = [(width + 2 * padding, height + 2 * padding) for width, height in sizes]
+        layout = choose_layout(padded, max_size)
+        if layout:
+            break
+        if all(size == (1, 1) for size in sizes):
+            raise ValueError(f'{len(images)} texture(s) with padding {padding} do not fit in a {max_size}px atlas')
+        scale /= 2
+
+    atlas_width, atlas_height, positions = layout
+    canvas = np.zeros((atlas_height, atlas_width, 3), dtype=np.uint8)
+    rects = []
+    for image, (width, height), (x, y) in zip(images, sizes, positions):
+        if (width, height) != image.size:
+            image = image.resize((width, height), Image.LANCZOS)
+        pixels = np.asarray(image.convert('RGB'))
+        # Extrude the border into the padding
+        canvas[y:y + height + 2 * padding, x:x + width + 2 * padding] = \
+            np.pad(pixels, ((padding, padding), (padding, padding), (0, 0)), mode='edge')
+        rects.append((x + padding, y + padding, width, height))
+    return Image.fromarray(canvas), rects
+
+
+def uv_rect(rect, atlas_size):
+    """Normalized ``u0, v0, u1, v1`` of a pixel rectangle, with v measured from the top."""
+    x, y, width, height = rect
+    atlas_width, atlas_height = atlas_size
+    return {
+        'u0': x / atlas_width,
+        'v0': y / atlas_height,
+        'u1': (x + width) / atlas_width,
+        'v1': (y + height) / atlas_height
+    }
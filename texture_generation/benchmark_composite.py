@@ -0,0 +1,123 @@
+"""Time /api/composite on a full-resolution photo, per compositing mode.
+
+    python benchmark_composite.py                                   # synthetic 4032x3024 scene
+    python benchmark_composite.py --width 6000 --height 4000
+    python benchmark_composite.py --upload static/uploads/<uploadId>.json --texture some_texture.png
+
+'render' is the compositing alone. 'warm' is everything the endpoint does on a
+cache miss, hashing the inputs, copying the decoded photo, rendering, encoding
+the JPEG and writing it, with the photo already decoded (as after
+segmentation). 'cold' also decodes the photo and texture files.
+
+The synthetic scene has a large sofa-like polygon and a smaller one that
+overlaps it, over a photo with a lighting gradient, a cast shadow and a fine
+material texture, so the numbers are close to a real furniture shot. It is
+saved as a JPEG first so decoding is measured on a real file.
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+from composite import composite, encode_jpeg, polygon_region, DecodedImages, COMPOSITE_MODES
+
+
+def synthetic_scene(width, height):
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    lighting = (0.45 + 0.75 * x / width) * np.where(y > 0.55 * height, 0.65, 1.0)
+    material = 130 + 35 * np.sin(x / 5) * np.sin(y / 7)
+    luminance = material * lighting
+    photo = np.clip(np.dstack([luminance, luminance * 0.92, luminance * 0.8]), 0, 255).astype(np.uint8)
+
+    def polygon(*points):
+        return [[int(px * width), int(py * height)] for px, py in points]
+
+    masks = [
+        polygon((0.1, 0.25), (0.85, 0.2), (0.9, 0.8), (0.5, 0.9), (0.08, 0.8)),
+        polygon((0.6, 0.1), (0.95, 0.12), (0.92, 0.55), (0.62, 0.5))
+    ]
+    return photo, masks
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def render_request(decoded_images, photo_path, texture_path, masks, tileable, mode, out_path):
+    """The work /api/composite does on a cache miss."""
+    photo_digest = file_digest(photo_path)
+    texture_digest = file_digest(texture_path)
+    photo = decoded_images.get(photo_path, photo_digest).copy()
+    texture = decoded_images.get(texture_path, texture_digest)
+    out = composite(photo, [(points, texture, tileable) for points in masks], mode=mode)
+    with open(out_path, 'wb') as f:
+        f.write(encode_jpeg(out))
+
+
+def median_ms(run, repeat):
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark server-side compositing')
+    parser.add_argument('--upload', help='Segmentation sidecar of an upload (default: synthetic scene)')
+    parser.add_argument('--texture', help='Texture to apply (default: random noise)')
+    parser.add_argument('--width', type=int, default=4032, help='Width of the synthetic photo')
+    parser.add_argument('--height', type=int, default=3024, help='Height of the synthetic photo')
+    parser.add_argument('--tileable', action='store_true', help='Repeat the texture instead of stretching it')
+    parser.add_argument('--repeat', type=int, default=10, help='Timed runs per mode')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    if args.upload:
+        with open(args.upload) as f:
+            segmentation = json.load(f)
+        photo_path = os.path.join(os.path.dirname(args.upload), segmentation['image'])
+        masks = [mask['points'] for mask in segmentation['masks']]
+    else:
+        photo, masks = synthetic_scene(args.width, args.height)
+        photo_path = os.path.join(workdir, 'photo.jpg')
+        Image.fromarray(photo).save(photo_path, quality=95)
+    if args.texture:
+        texture_path = args.texture
+    else:
+        texture_path = os.path.join(workdir, 'texture.png')
+        Image.fromarray(np.random.default_rng(0).integers(40, 220, (1024, 1024, 3), dtype=np.uint8)).save(texture_path)
+    out_path = os.path.join(workdir, 'composite.jpg')
+
+    decoded_images = DecodedImages()
+    photo = decoded_images.get(photo_path, file_digest(photo_path))
+    texture = decoded_images.get(texture_path, file_digest(texture_path))
+    covered = np.zeros(photo.shape[:2], dtype=bool)
+    for points in masks:
+        region = polygon_region(points, photo.shape)
+        if region:
+            (x0, y0, x1, y1), mask = region
+            covered[y0:y1, x0:x1] |= mask > 0
+    print(f"{photo.shape[1]}x{photo.shape[0]}, {len(masks)} polygon(s) covering {covered.mean():.0%} of the photo")
+
+    layers = [(points, texture, args.tileable) for points in masks]
+    print(f"{'mode':<7} {'render ms':>10} {'warm ms':>8} {'cold ms':>8}   (medians)")
+    for mode in COMPOSITE_MODES:
+        # composite() paints in place; copying the photo is not timed here
+        canvases = [photo.copy() for _ in range(args.repeat + 1)]
+        render = median_ms(lambda: composite(canvases.pop(), layers, mode=mode), args.repeat)
+        warm = median_ms(lambda: render_request(decoded_images, photo_path, texture_path, masks,
+                                                args.tileable, mode, out_path), args.repeat)
+        cold = median_ms(lambda: render_request(DecodedImages(), photo_path, texture_path, masks,
+                                                args.tileable, mode, out_path), args.repeat)
+        print(f"{mode:<7} {render:>10.1f} {warm:>8.1f} {cold:>8.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Measure seconds per denoising step of the CPU inference mode.
+
+    python benchmark_cpu.py --dtype fp32 bf16 --threads 4 8 --tier preview
+    python benchmark_cpu.py --model stub --compile
+
+Each combination of dtype and thread count loads the pipeline through
+load_pipeline(device='cpu') and times the UNet steps with the step callback,
+so text encoding and VAE decode are reported separately as overhead.
+"""
+import argparse
+import itertools
+import time
+import numpy as np
+import torch
+from generation import load_pipeline, MODEL_ID, QUALITY_TIERS
+
+STUB_MODEL_ID = 'hf-internal-testing/tiny-stable-diffusion-pipe'
+
+
+def time_run(pipe, settings, seed):
+    step_times = []
+    last = [None]
+
+    def on_step_end(pipeline, step, timestep, callback_kwargs):
+        now = time.perf_counter()
+        step_times.append(now - last[0])
+        last[0] = now
+        return callback_kwargs
+
+    generator = torch.Generator(device='cpu').manual_seed(seed)
+    start = time.perf_counter()
+
+    # The first step is measured from when the denoising loop starts calling back
+    last[0] = start
+    with torch.no_grad():
+        pipe(
+            prompt='Oak wood texture, high resolution',
+            negative_prompt='blurry, low quality, distorted, unrealistic',
+            num_inference_steps=settings['num_inference_steps'],
+            guidance_scale=settings['guidance_scale'],
+            width=settings['size'],
+            height=settings['size'],
+            generator=generator,
+            callback_on_step_end=on_step_end
+        )
+    total = time.perf_counter() - start
+    return step_times, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CPU diffusion seconds per step')
+    parser.add_argument('--model', choices=['stub', 'real'], default='real')
+    parser.add_argument('--dtype', nargs='+', default=['fp32', 'bf16'], choices=['fp32', 'bf16'])
+    parser.add_argument('--threads', nargs='+', type=int, default=[0], help='0 = all available cores')
+    parser.add_argument('--tier', choices=sorted(QUALITY_TIERS), default='preview')
+    parser.add_argument('--compile', action='store_true', help='torch.compile the UNet')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    model_id = STUB_MODEL_ID if args.model == 'stub' else MODEL_ID
+    settings = QUALITY_TIERS[args.tier]
+
+    rows = []
+    for dtype, threads in itertools.product(args.dtype, args.threads):
+        pipe = load_pipeline(model_id, device='cpu', cpu_dtype=dtype, cpu_threads=threads,
+                             compile_unet=args.compile)
+        if args.model == 'stub':
+            pipe.safety_checker = None
+
+        # Warm-up run absorbs one-off costs such as torch.compile and oneDNN kernel selection
+        time_run(pipe, settings, args.seed)
+
+        step_times, totals = [], []
+        for _ in range(args.repeats):
+            steps, total = time_run(pipe, settings, args.seed)
+            # Skip the first step, which also includes prompt encoding
+            step_times.extend(steps[1:])
+            totals.append(total)
+        rows.append((dtype, torch.get_num_threads(), np.mean(step_times), np.mean(totals)))
+        del pipe
+
+    print(f"\nModel: {model_id}, tier: {args.tier} ({settings['num_inference_steps']} steps, "
+          f"{settings['size']} px), compile: {args.compile}")
+    print(f"{'dtype':<8}{'threads':>8}{'s/step':>10}{'total s':>10}")
+    for dtype, threads, per_step, total in rows:
+        print(f"{dtype:<8}{threads:>8}{per_step:>10.3f}{total:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
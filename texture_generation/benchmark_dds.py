@@ -0,0 +1,62 @@
+"""Compare the block-compression formats and quality settings of the DDS export.
+
+    python benchmark_dds.py static/generated_textures/cache/ab/abcd.png
+    python benchmark_dds.py --size 2048        # synthetic texture
+
+For each format and quality, reports encode time, RGB RMSE of the decoded top
+level against the source and the GPU memory of the whole mip chain compared
+with uploading uncompressed RGBA8 levels.
+"""
+import argparse
+import io
+import time
+import numpy as np
+from PIL import Image
+from dds import encode_dds, BC_FORMATS, BC_QUALITIES
+
+
+def synthetic_texture(size):
+    """Gradient plus noise, a rough stand-in for a generated texture."""
+    y, x = np.mgrid[0:size, 0:size] / size
+    pixels = np.stack([x * 200, y * 200, (x + y) * 100], axis=-1)
+    pixels += np.random.default_rng(0).normal(0, 12, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def rgba_chain_bytes(width, height):
+    total = 0
+    while True:
+        total += width * height * 4
+        if width == 1 and height == 1:
+            return total
+        width, height = max(1, width // 2), max(1, height // 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark BC1/BC3 DDS export')
+    parser.add_argument('image', nargs='?', help='Texture to compress (default: synthetic)')
+    parser.add_argument('--size', type=int, default=1024, help='Size of the synthetic texture')
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert('RGBA') if args.image else synthetic_texture(args.size).convert('RGBA')
+    source = np.asarray(image).astype(np.float32)
+    uncompressed = rgba_chain_bytes(image.width, image.height)
+
+    print(f"{image.width}x{image.height}, uncompressed RGBA8 chain: {uncompressed / 2 ** 20:.1f} MB")
+    print(f"{'format':<7} {'quality':<8} {'seconds':>8} {'rmse':>7} {'MB':>7} {'smaller':>8}")
+    for fmt in BC_FORMATS:
+        for quality in BC_QUALITIES:
+            start = time.perf_counter()
+            data = encode_dds(image, fmt, quality)
+            seconds = time.perf_counter() - start
+
+            decoded = Image.open(io.BytesIO(data))
+            decoded.load()
+            error = np.asarray(decoded.convert('RGBA')).astype(np.float32)[..., :3] - source[..., :3]
+            rmse = float(np.sqrt((error ** 2).mean()))
+            print(f"{fmt:<7} {quality:<8} {seconds:>8.3f} {rmse:>7.2f} {len(data) / 2 ** 20:>7.2f} "
+                  f"{uncompressed / len(data):>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
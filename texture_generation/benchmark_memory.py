@@ -0,0 +1,66 @@
+"""Measure peak RSS of producing large textures versus output resolution.
+
+    python benchmark_memory.py --sizes 1024 2048 4096
+
+Post-processing upscales a 512px render to each size and writes a PNG, either
+as one image (lanczos_unsharp + PIL) or strip by strip (chunked). Every case
+runs in a fresh process, since peak RSS only ever grows.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+SOURCE_SIZE = 512
+
+
+def run_postprocess(mode, size):
+    import numpy as np
+    from PIL import Image
+    from chunked import lanczos_strips, write_png
+    from upscale import lanczos_unsharp
+
+    source = Image.fromarray(np.random.randint(0, 256, (SOURCE_SIZE, SOURCE_SIZE, 3), dtype=np.uint8))
+    path = os.path.join(tempfile.mkdtemp(), 'texture.png')
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == 'chunked':
+        write_png(path, (size, size), lanczos_strips(source, (size, size)))
+    else:
+        lanczos_unsharp(source, (size, size)).save(path, format='PNG')
+    return baseline, time.perf_counter() - start
+
+
+def measure(mode, size, results):
+    baseline, seconds = run_postprocess(mode, size)
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((peak / 1024, (peak - baseline) / 1024, seconds))
+
+
+def run_case(mode, size):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=measure, args=(mode, size, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark peak memory versus texture resolution')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1024, 2048, 3072, 4096])
+    args = parser.parse_args()
+
+    print(f"{'mode':<8} {'size':>6} {'peak MB':>9} {'added MB':>9} {'seconds':>8}")
+    for mode in ('full', 'chunked'):
+        for size in args.sizes:
+            peak, added, seconds = run_case(mode, size)
+            print(f"{mode:<8} {size:>6} {peak:>9.0f} {added:>9.0f} {seconds:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
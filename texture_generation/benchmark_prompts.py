@@ -0,0 +1,70 @@
+"""Measure how prompt canonicalization affects generation cache hit rates.
+
+    GENERATION_PROMPT_LOG=prompts.jsonl python app.py   # collect a request log
+    python benchmark_prompts.py prompts.jsonl
+
+Replays the logged /api/generate-texture requests against an unbounded cache
+and compares keying by the raw prompt with keying by the canonical prompt
+(catalog requests are keyed by texture id in both cases).
+"""
+import argparse
+import json
+from collections import Counter, defaultdict
+from prompts import canonicalize_prompt, canonical_template
+
+
+def raw_key(entry):
+    if entry.get('textureId') is not None:
+        return f"texture:{entry['textureId']}"
+    if entry.get('prompt'):
+        return entry['prompt']
+    return f"Generate a seamless texture for {entry.get('maskClass')} with the following characteristics: " \
+           f"{entry.get('textureDescription')}"
+
+
+def canonical_key(entry):
+    if entry.get('textureId') is not None:
+        return f"texture:{entry['textureId']}"
+    if entry.get('prompt'):
+        return canonicalize_prompt(entry['prompt'])
+    return canonical_template(entry.get('maskClass') or '', entry.get('textureDescription') or '')
+
+
+def hit_rate(keys):
+    """Share of requests that repeat an earlier key."""
+    return 1 - len(set(keys)) / len(keys) if keys else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure prompt canonicalization on a request log')
+    parser.add_argument('log', help='JSONL prompt log written with GENERATION_PROMPT_LOG')
+    parser.add_argument('--top', type=int, default=10, help='Number of merged groups to show')
+    args = parser.parse_args()
+
+    with open(args.log) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    raw = [raw_key(entry) for entry in entries]
+    canonical = [canonical_key(entry) for entry in entries]
+
+    print(f"Requests:             {len(entries)}")
+    print(f"Distinct raw keys:    {len(set(raw))}")
+    print(f"Distinct canonical:   {len(set(canonical))}")
+    print(f"Hit rate (raw):       {hit_rate(raw):.1%}")
+    print(f"Hit rate (canonical): {hit_rate(canonical):.1%}")
+
+    # Canonical keys that absorbed the most raw variants
+    variants = defaultdict(set)
+    for raw_prompt, key in zip(raw, canonical):
+        variants[key].add(raw_prompt)
+    counts = Counter(canonical)
+    merged = sorted((key for key in variants if len(variants[key]) > 1),
+                    key=lambda key: (-len(variants[key]), -counts[key]))
+    if merged:
+        print("\nMost merged prompts:")
+        for key in merged[:args.top]:
+            print(f"  {len(variants[key])} variants, {counts[key]} requests: {key}")
+
+
+if __name__ == '__main__':
+    main()
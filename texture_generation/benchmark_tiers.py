@@ -0,0 +1,80 @@
+"""Compare latency and output difference of the quality tiers.
+
+    python benchmark_tiers.py --model stub   # tiny random-weight pipeline on CPU
+    python benchmark_tiers.py --model real   # the configured model via load_pipeline()
+
+Every tier renders the same prompts with the same seeds. The difference is the
+mean absolute pixel error (0-255) against the ``final`` tier output, after
+resizing both to the final resolution. ``seam`` is tiling.seam_error() of the
+outputs; with --tileable it should stay close to 1.0.
+"""
+import argparse
+import time
+import numpy as np
+from PIL import Image
+from generation import load_pipeline, GenerationJob, GenerationWorker, QUALITY_TIERS
+from tiling import seam_error
+
+STUB_MODEL_ID = 'hf-internal-testing/tiny-stable-diffusion-pipe'
+
+PROMPTS = [
+    'Oak wood texture, high resolution',
+    'Gray linen fabric texture, high resolution',
+    'White marble texture, high resolution'
+]
+
+
+def load_stub_pipeline():
+    """Tiny pipeline with random weights; useful for timing the code path on CPU."""
+    pipe = load_pipeline(STUB_MODEL_ID, device='cpu', cpu_dtype='fp32')
+    pipe.safety_checker = None
+    return pipe
+
+
+def mean_abs_diff(image, reference):
+    resized = image.resize(reference.size, Image.BICUBIC)
+    return float(np.abs(np.asarray(resized, dtype=np.float32) - np.asarray(reference, dtype=np.float32)).mean())
+
+
+def run_tier(worker, tier, seed, repeats, tileable=False):
+    latencies = []
+    images = []
+    for _ in range(repeats):
+        images = []
+        for prompt in PROMPTS:
+            job = GenerationJob(prompt=prompt, tier=tier, seed=seed, tileable=tileable)
+            start = time.perf_counter()
+            images.append(worker.submit(job).wait())
+            latencies.append(time.perf_counter() - start)
+    return latencies, images
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark texture generation quality tiers')
+    parser.add_argument('--model', choices=['stub', 'real'], default='stub')
+    parser.add_argument('--repeats', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--tileable', action='store_true', help='Generate with circular padding')
+    args = parser.parse_args()
+
+    pipe = load_stub_pipeline() if args.model == 'stub' else load_pipeline()
+    worker = GenerationWorker(pipe, max_batch_size=1, batch_wait=0).start()
+
+    # Warm up so model loading and kernel selection are not counted
+    run_tier(worker, 'final', args.seed, 1, args.tileable)
+
+    results = {tier: run_tier(worker, tier, args.seed, args.repeats, args.tileable) for tier in QUALITY_TIERS}
+    reference = results['final'][1]
+
+    print(f"\nModel: {args.model}, prompts: {len(PROMPTS)}, repeats: {args.repeats}, tileable: {args.tileable}")
+    print(f"{'tier':<10}{'steps':>6}{'size':>6}{'mean s':>10}{'p95 s':>10}{'diff':>10}{'seam':>8}")
+    for tier, (latencies, images) in results.items():
+        settings = QUALITY_TIERS[tier]
+        diff = np.mean([mean_abs_diff(image, ref) for image, ref in zip(images, reference)])
+        seam = np.mean([seam_error(image) for image in images])
+        print(f"{tier:<10}{settings['num_inference_steps']:>6}{settings['size']:>6}"
+              f"{np.mean(latencies):>10.3f}{np.percentile(latencies, 95):>10.3f}{diff:>10.2f}{seam:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
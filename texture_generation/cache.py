@@ -0,0 +1,80 @@
+import os
+import json
+import hashlib
+import uuid
+from chunked import write_png
+
+# Generated textures are stored on disk under a hash of everything that
+# determines the output, so identical requests can reuse the same file.
+CACHE_DIR = os.getenv('GENERATION_CACHE_DIR', os.path.join('static', 'generated_textures', 'cache'))
+
+
+def make_cache_key(**params):
+    """Hash generation parameters into a stable cache key."""
+    payload = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class GenerationCache:
+    """Content-addressed store of generated textures on local disk."""
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key, ext='png'):
+        # Shard by key prefix so a large catalog does not end up in one directory
+        return os.path.join(self.root, key[:2], f'{key}.{ext}')
+
+    def get(self, key, ext='png'):
+        """Return the cached file path for ``key``, or None on a miss."""
+        path = self.path_for(key, ext)
+        return path if os.path.exists(path) else None
+
+    def put(self, key, image, ext='png', **options):
+        """Store a PIL image under ``key`` and return its path. ``options`` go to ``Image.save``."""
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial image
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        image.save(tmp_path, format=ext.upper(), **options)
+        os.replace(tmp_path, path)
+        return path
+
+    def put_bytes(self, key, data, ext):
+        """Store an already encoded file (e.g. a DDS texture) under ``key`` and return its path."""
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def get_json(self, key, ext='json'):
+        """Load a JSON document stored under ``key``, or None on a miss."""
+        path = self.get(key, ext)
+        if not path:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def put_json(self, key, data, ext='json'):
+        """Store a JSON document (e.g. a manifest) under ``key`` and return its path."""
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        return path
+
+    def put_strips(self, key, size, strips):
+        """Store an RGB image given as row strips (see ``chunked``) as a PNG and return its path."""
+        path = self.path_for(key, 'png')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        write_png(tmp_path, size, strips)
+        os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,100 @@
+import os
+import struct
+import zlib
+import numpy as np
+from PIL import Image, ImageFilter
+from upscale import get_upscaler
+
+# Outputs with more pixels than this are upscaled and written to disk in
+# horizontal strips, so 2K-4K textures never exist as one image in memory
+STREAM_OUTPUT_PIXELS = int(os.getenv('GENERATION_STREAM_OUTPUT_PIXELS', str(1024 * 1024)))
+STRIP_ROWS = int(os.getenv('GENERATION_STRIP_ROWS', '256'))
+PNG_COMPRESSION = int(os.getenv('GENERATION_PNG_COMPRESSION', '6'))
+
+# Extra rows resized above and below each strip so the unsharp mask sees real
+# neighbours at strip edges (PIL's blur reaches about 3x its radius)
+SHARPEN_MARGIN = 8
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def should_stream(size):
+    return size[0] * size[1] > STREAM_OUTPUT_PIXELS
+
+
+def image_strips(image, rows=STRIP_ROWS):
+    """Yield an image as RGB uint8 arrays of up to ``rows`` rows, top to bottom."""
+    image = image.convert('RGB')
+    for top in range(0, image.height, rows):
+        yield np.asarray(image.crop((0, top, image.width, min(image.height, top + rows))))
+
+
+def lanczos_strips(image, size, rows=STRIP_ROWS):
+    """``lanczos_unsharp(image, size)`` produced strip by strip.
+
+    Each strip is resized from the full source with a ``box``, so Lanczos
+    reads the same source pixels it would for the whole image and the strips
+    join without seams.
+    """
+    image = image.convert('RGB')
+    width, height = size
+    sharpen = width > image.width or height > image.height
+    margin = SHARPEN_MARGIN if sharpen else 0
+    scale_y = image.height / height
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        outer_top, outer_bottom = max(0, top - margin), min(height, bottom + margin)
+        strip = image.resize((width, outer_bottom - outer_top), Image.LANCZOS,
+                             box=(0, outer_top * scale_y, image.width, outer_bottom * scale_y))
+        if sharpen:
+            strip = strip.filter(ImageFilter.UnsharpMask(radius=2, percent=60, threshold=2))
+        yield np.asarray(strip)[top - outer_top:bottom - outer_top]
+
+
+def upscale_strips(image, size, upscaler=None):
+    """Strips of ``image`` upscaled to ``size`` with the named upscaler.
+
+    Only Lanczos works strip by strip; other upscalers produce the whole image
+    first and are only streamed into the encoder.
+    """
+    if (upscaler or 'lanczos') == 'lanczos':
+        return lanczos_strips(image, size)
+    return image_strips(get_upscaler(upscaler)(image, size))
+
+
+def _write_chunk(f, kind, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+
+def write_png(path, size, strips, compression=PNG_COMPRESSION):
+    """Write RGB row strips to an 8-bit PNG without holding the whole image.
+
+    Rows use the PNG "up" filter (difference with the row above), computed a
+    strip at a time with NumPy, and are deflated as they arrive.
+    """
+    width, height = size
+    compressor = zlib.compressobj(compression)
+    previous = np.zeros(width * 3, dtype=np.uint8)
+    written = 0
+    with open(path, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        _write_chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        for strip in strips:
+            rows = np.ascontiguousarray(strip, dtype=np.uint8).reshape(len(strip), width * 3)
+            filtered = np.empty((len(rows), width * 3 + 1), dtype=np.uint8)
+            filtered[:, 0] = 2
+            filtered[0, 1:] = rows[0] - previous
+            filtered[1:, 1:] = rows[1:] - rows[:-1]
+            data = compressor.compress(filtered.tobytes())
+            if data:
+                _write_chunk(f, b'IDAT', data)
+            previous = rows[-1]
+            written += len(rows)
+        _write_chunk(f, b'IDAT', compressor.flush())
+        _write_chunk(f, b'IEND', b'')
+    if written != height:
+        raise ValueError(f"Expected {height} rows, got {written}")
+    return path
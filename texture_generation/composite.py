@@ -0,0 +1,250 @@
+import os
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+import metrics
+
+# 'blend' pastes textures as they are; 'shade' keeps the photo's lighting by
+# multiplying each texture with the shading of the region it replaces
+COMPOSITE_MODES = ('blend', 'shade')
+
+# Shading layer: a self-guided filter of the region's luminance. Detail with a
+# variance below SHADING_EPS (the old material's texture) is smoothed away,
+# stronger edges like folds and cast shadows are kept. Shading is smooth, so
+# the filter and the edge feathering run on a copy downsampled to about
+# SHADING_SIZE pixels across and are upsampled.
+SHADING_RADIUS = 1 / 32
+SHADING_EPS = 0.01
+SHADING_SIZE = 256
+
+# Width of the soft edge, relative to the photo's longer side
+FEATHER = 1 / 400
+
+# Per-pixel texture gains are kept in uint8 as gain * GAIN_SCALE, so the final
+# blend runs as fixed-point OpenCV arithmetic instead of float32 NumPy. This
+# also caps how much highlights can brighten a texture, at 255 / GAIN_SCALE.
+GAIN_SCALE = 100
+
+# Rows blended at a time, so the intermediate maps stay in the CPU cache
+STRIP_ROWS = 32
+
+# Finished composites are full-resolution photos, stored as JPEG: encoding a
+# 12 MP frame as PNG takes seconds
+COMPOSITE_JPEG_QUALITY = int(os.getenv('GENERATION_COMPOSITE_JPEG_QUALITY', '90'))
+
+# Decoded photos and textures kept in memory, so compositing an upload again
+# with other textures does not decode the photo again. A 12 MP photo is 36 MB.
+COMPOSITE_IMAGE_CACHE_SIZE = int(os.getenv('GENERATION_COMPOSITE_IMAGE_CACHE_SIZE', '8'))
+
+
+def polygon_region(points, shape):
+    """Bounding box ``(x0, y0, x1, y1)`` of a polygon clipped to an image of ``shape``,
+    and the polygon filled into a uint8 mask of the box. None if it falls outside.
+    """
+    points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+    height, width = shape[:2]
+    x0, y0 = np.maximum(points.min(axis=0), 0)
+    x1, y1 = np.minimum(points.max(axis=0), [width, height])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.fillPoly(mask, [points - [x0, y0]], 255)
+    return (int(x0), int(y0), int(x1), int(y1)), mask
+
+
+def fit_texture(texture, width, height, tileable=False):
+    """Texture pixels covering a ``width`` x ``height`` box.
+
+    Tileable textures repeat at their native size; others are stretched over
+    the box, the same way the frontend canvas draws them.
+    """
+    if tileable:
+        reps_y = -(-height // texture.shape[0])
+        reps_x = -(-width // texture.shape[1])
+        return cv2.repeat(texture, reps_y, reps_x)[:height, :width]
+    shrinking = width < texture.shape[1] and height < texture.shape[0]
+    return cv2.resize(texture, (width, height), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+
+def feather_weight(mask, radius):
+    """Float32 weight in 0-1 rising from the mask's edge to 1 at ``radius`` pixels inside."""
+    # Pad with background so edges on the box border are feathered too
+    padded = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    distance = cv2.distanceTransform(padded, cv2.DIST_L2, cv2.DIST_MASK_3)[1:-1, 1:-1]
+    return np.minimum(distance * (1 / radius), 1, out=distance)
+
+
+def shading_maps(crop, mask, alpha, feather):
+    """Texture gain and opacity maps that apply a region's shading and feather its edge.
+
+    ``crop`` is the original photo over the region's box and ``mask`` the
+    region inside it. The gain is the guided-filtered luminance divided by its
+    mean over the region, so the texture keeps its own brightness, times the
+    feathered opacity. Both are uint8 maps of the box at about SHADING_SIZE
+    pixels across, not yet clipped to the mask.
+    """
+    height, width = mask.shape
+    factor = max(1, -(-max(width, height) // SHADING_SIZE))
+    small_size = (max(1, width // factor), max(1, height // factor))
+    # Bilinear to twice the size, then area-average: close to a full area filter
+    # at a fraction of its cost on a large crop
+    small = cv2.resize(crop, (small_size[0] * 2, small_size[1] * 2), interpolation=cv2.INTER_LINEAR)
+    small = cv2.cvtColor(cv2.resize(small, small_size, interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+    small = small.astype(np.float32) * (1 / 255)
+    kernel = (2 * max(1, int(SHADING_RADIUS * max(small_size))) + 1,) * 2
+
+    mean = cv2.boxFilter(small, -1, kernel)
+    variance = cv2.boxFilter(small * small, -1, kernel) - mean * mean
+    a = variance / (variance + SHADING_EPS)
+    b = mean - a * mean
+    shading = cv2.boxFilter(a, -1, kernel) * small + cv2.boxFilter(b, -1, kernel)
+
+    small_mask = cv2.resize(mask, small_size, interpolation=cv2.INTER_NEAREST)
+    level = max(cv2.mean(shading, mask=small_mask if small_mask.any() else None)[0], 1e-3)
+    opacity = feather_weight(small_mask, feather / factor) * alpha
+
+    gain = cv2.convertScaleAbs(shading * opacity, alpha=GAIN_SCALE / level)
+    return gain, cv2.convertScaleAbs(opacity, alpha=255)
+
+
+def apply_gain(image, gain):
+    """``image * gain / GAIN_SCALE``, with ``gain`` a constant or a uint8 map
+    of any resolution covering the same area, stretched over ``image``."""
+    if not isinstance(gain, np.ndarray):
+        return image if gain == GAIN_SCALE else cv2.convertScaleAbs(image, alpha=gain / GAIN_SCALE)
+    gain = cv2.resize(gain, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_LINEAR)
+    return cv2.multiply(image, cv2.cvtColor(gain, cv2.COLOR_GRAY2RGB), scale=1 / GAIN_SCALE)
+
+
+def shaded_texture(texture, gain, width, height, tileable=False):
+    """Texture fitted to a ``width`` x ``height`` box with ``gain`` applied.
+
+    The gain goes on whichever of the texture and the fitted box has fewer
+    pixels. That is exact for a constant and, since a stretched texture maps
+    linearly onto the box, close for a gain map. Tiled textures only take a
+    constant gain this way.
+    """
+    if texture.shape[0] * texture.shape[1] > width * height:
+        return apply_gain(fit_texture(texture, width, height, tileable), gain)
+    return fit_texture(apply_gain(texture, gain), width, height, tileable)
+
+
+def paint_region(out, box, texture, mask, opacity, gain=None):
+    """``out = texture * gain / GAIN_SCALE + out * (255 - opacity) / 255`` inside ``mask``.
+
+    ``opacity`` is a uint8 map of the box or a constant for the whole region.
+    ``gain`` is a uint8 map of the box, or None if ``texture`` already has its
+    gain applied. Runs in strips of rows with fixed-point OpenCV arithmetic,
+    writing straight into ``out``.
+    """
+    x0, y0, x1, y1 = box
+    if not isinstance(opacity, np.ndarray):
+        if opacity == 255 and gain is None:
+            # Nothing of the photo shows through, so this is a masked copy
+            cv2.copyTo(texture, mask, out[y0:y1, x0:x1])
+            return
+        keep = np.full((min(STRIP_ROWS, y1 - y0), x1 - x0, 3), 255 - opacity, dtype=np.uint8)
+    for top in range(0, y1 - y0, STRIP_ROWS):
+        rows = slice(top, top + STRIP_ROWS)
+        strip_mask = mask[rows]
+        target = out[y0 + top:y0 + top + strip_mask.shape[0], x0:x1]
+        if isinstance(opacity, np.ndarray):
+            strip_keep = cv2.cvtColor(cv2.bitwise_not(opacity[rows]), cv2.COLOR_GRAY2RGB)
+        else:
+            strip_keep = keep[:strip_mask.shape[0]]
+        painted = texture[rows]
+        if gain is not None:
+            painted = cv2.multiply(painted, cv2.cvtColor(gain[rows], cv2.COLOR_GRAY2RGB), scale=1 / GAIN_SCALE)
+        kept = cv2.multiply(target, strip_keep, scale=1 / 255)
+        # Masked add with target as dst: pixels outside the mask are untouched
+        cv2.add(kept, painted, dst=target, mask=strip_mask)
+
+
+def composite(photo, layers, alpha=1.0, mode='blend'):
+    """Render textures into their mask polygons of a photo, in place.
+
+    ``photo`` is a writable RGB uint8 array and ``layers`` a list of
+    ``(points, texture, tileable)`` with RGB uint8 textures, drawn in order.
+    Each polygon gets its texture fitted to its own bounding box, as the
+    frontend does, and blended in with opacity ``alpha``. In 'shade' mode the
+    texture also takes on the shading of the photo underneath, with feathered
+    edges. Returns ``photo``.
+    """
+    if mode not in COMPOSITE_MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of: {', '.join(COMPOSITE_MODES)}")
+
+    feather = max(1.0, FEATHER * max(photo.shape[:2]))
+    regions = []
+    for points, texture, tileable in layers:
+        region = polygon_region(points, photo.shape)
+        if region is None:
+            continue
+        box, mask = region
+        x0, y0, x1, y1 = box
+        if mode == 'shade':
+            # Measured on the original photo, before any layer paints over it
+            gain, opacity = shading_maps(photo[y0:y1, x0:x1], mask, alpha, feather)
+            opacity = cv2.resize(opacity, (x1 - x0, y1 - y0), interpolation=cv2.INTER_LINEAR)
+        else:
+            gain, opacity = int(round(alpha * GAIN_SCALE)), int(round(alpha * 255))
+        regions.append((box, mask, texture, tileable, gain, opacity))
+
+    for box, mask, texture, tileable, gain, opacity in regions:
+        x0, y0, x1, y1 = box
+        if tileable and isinstance(gain, np.ndarray):
+            # The gain map changes across the repeated tiles, so it is applied
+            # a strip at a time while painting
+            texture = fit_texture(texture, x1 - x0, y1 - y0, tileable)
+            gain = cv2.resize(gain, (x1 - x0, y1 - y0), interpolation=cv2.INTER_LINEAR)
+        else:
+            texture, gain = shaded_texture(texture, gain, x1 - x0, y1 - y0, tileable), None
+        paint_region(photo, box, texture, mask, opacity, gain)
+    return photo
+
+
+class DecodedImages:
+    """LRU cache of images decoded to RGB uint8 arrays, keyed by content digest.
+
+    The arrays are shared between requests and read-only; copy one before
+    painting into it.
+    """
+
+    def __init__(self, max_entries=COMPOSITE_IMAGE_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.register_gauge('composite_image_cache_hit_rate',
+                               lambda: metrics.ratio('composite_image_cache_hits', 'composite_image_cache_lookups'))
+        metrics.register_gauge('composite_image_cache_entries', lambda: len(self._entries))
+
+    def get(self, path, digest):
+        """Pixels of the image at ``path``, whose content hashes to ``digest``."""
+        metrics.increment('composite_image_cache_lookups')
+        with self._lock:
+            pixels = self._entries.get(digest)
+            if pixels is not None:
+                self._entries.move_to_end(digest)
+                metrics.increment('composite_image_cache_hits')
+                return pixels
+
+        # OpenCV decodes a large JPEG about twice as fast as PIL. EXIF rotation
+        # is ignored, as in the segmentation, so the mask points line up.
+        pixels = cv2.imread(path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if pixels is None:
+            raise ValueError(f'Could not decode {path}')
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB)
+        pixels.flags.writeable = False
+        with self._lock:
+            self._entries[digest] = pixels
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return pixels
+
+
+def encode_jpeg(image, quality=COMPOSITE_JPEG_QUALITY):
+    """JPEG bytes of an RGB uint8 array."""
+    ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(image, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError('Could not encode the composite as JPEG')
+    return encoded.tobytes()
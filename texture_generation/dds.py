@@ -0,0 +1,180 @@
+import os
+import struct
+import numpy as np
+from PIL import Image
+
+# Block-compressed formats and the DDS FourCC they are stored under. BC1 holds
+# RGB in 4 bits per pixel, BC3 adds an interpolated alpha block (8 bits per pixel).
+BC_FORMATS = {
+    'bc1': b'DXT1',
+    'bc3': b'DXT5'
+}
+
+# 'fast' takes each block's bounding-box corners as endpoints; 'high' fits them
+# along the block's principal axis and refines them by least squares
+BC_QUALITIES = ('fast', 'high')
+BC_QUALITY = os.getenv('GENERATION_BC_QUALITY', 'high')
+
+# Number of 4x4 blocks encoded at once, which bounds the temporary arrays
+BLOCK_CHUNK = 65536
+
+BC1_BLOCK = np.dtype([('c0', '<u2'), ('c1', '<u2'), ('indices', '<u4')])
+ALPHA_BLOCK = np.dtype([('a0', 'u1'), ('a1', 'u1'), ('indices', 'u1', 6)])
+BC3_BLOCK = np.dtype([('alpha', ALPHA_BLOCK), ('color', BC1_BLOCK)])
+
+# Weight of the first endpoint for each 2-bit BC1 index in four-color mode
+COLOR_WEIGHTS = np.array([1.0, 0.0, 2 / 3, 1 / 3], dtype=np.float32)
+
+
+def to_blocks(pixels):
+    """Split an (h, w, c) array into (blocks, 16, c), padding edges to multiples of 4."""
+    height, width, channels = pixels.shape
+    pixels = np.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode='edge')
+    rows, cols = pixels.shape[0] // 4, pixels.shape[1] // 4
+    return pixels.reshape(rows, 4, cols, 4, channels).transpose(0, 2, 1, 3, 4).reshape(-1, 16, channels)
+
+
+def pack_565(colors):
+    scale = np.array([31, 63, 31], dtype=np.float32) / 255.0
+    r, g, b = np.clip(np.round(colors * scale), 0, [31, 63, 31]).astype(np.uint16).T
+    return (r << 11) | (g << 5) | b
+
+
+def unpack_565(packed):
+    r, g, b = (packed >> 11) & 31, (packed >> 5) & 63, packed & 31
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1).astype(np.float32)
+
+
+def color_palette(c0, c1):
+    """Four-color BC1 palette of each block, shape (blocks, 4, 3)."""
+    weights = COLOR_WEIGHTS[None, :, None]
+    return weights * c0[:, None, :] + (1 - weights) * c1[:, None, :]
+
+
+def nearest(values, palette):
+    """Index of the closest palette entry for every pixel of every block."""
+    distances = ((values[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)
+    return distances.argmin(axis=-1)
+
+
+def principal_endpoints(blocks):
+    """Endpoints at the extremes of each block's projection onto its principal color axis."""
+    mean = blocks.mean(axis=1)
+    centered = blocks - mean[:, None, :]
+    covariance = np.einsum('nki,nkj->nij', centered, centered)
+    axis = np.ones_like(mean)
+    for _ in range(4):
+        axis = np.einsum('nij,nj->ni', covariance, axis)
+        axis /= np.linalg.norm(axis, axis=1, keepdims=True) + 1e-6
+    projection = np.einsum('nki,ni->nk', centered, axis)
+    high = mean + projection.max(axis=1)[:, None] * axis
+    low = mean + projection.min(axis=1)[:, None] * axis
+    return np.clip(high, 0, 255), np.clip(low, 0, 255)
+
+
+def refine_endpoints(blocks, indices, c0, c1):
+    """Least-squares endpoints for fixed indices; blocks with a degenerate fit keep theirs."""
+    a = COLOR_WEIGHTS[indices]
+    b = 1 - a
+    aa, bb, ab = (a * a).sum(axis=1), (b * b).sum(axis=1), (a * b).sum(axis=1)
+    ax = np.einsum('nk,nki->ni', a, blocks)
+    bx = np.einsum('nk,nki->ni', b, blocks)
+    det = aa * bb - ab * ab
+    ok = np.abs(det) > 1e-6
+    safe = np.where(ok, det, 1.0)[:, None]
+    e0 = np.where(ok[:, None], (ax * bb[:, None] - bx * ab[:, None]) / safe, c0)
+    e1 = np.where(ok[:, None], (bx * aa[:, None] - ax * ab[:, None]) / safe, c1)
+    return np.clip(e0, 0, 255), np.clip(e1, 0, 255)
+
+
+def encode_color_blocks(blocks, quality=BC_QUALITY):
+    """BC1 blocks for (blocks, 16, 3) float RGB pixels."""
+    if quality == 'fast':
+        high, low = blocks.max(axis=1), blocks.min(axis=1)
+    else:
+        high, low = principal_endpoints(blocks)
+    c0, c1 = pack_565(high), pack_565(low)
+
+    if quality != 'fast':
+        indices = nearest(blocks, color_palette(unpack_565(c0), unpack_565(c1)))
+        high, low = refine_endpoints(blocks, indices, unpack_565(c0), unpack_565(c1))
+        c0, c1 = pack_565(high), pack_565(low)
+
+    # Four-color mode needs c0 > c1; equal endpoints would switch to three colors
+    # plus transparent black, so those blocks only use index 0
+    swap = c0 < c1
+    c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+    indices = nearest(blocks, color_palette(unpack_565(c0), unpack_565(c1)))
+    indices[c0 == c1] = 0
+
+    out = np.empty(len(blocks), dtype=BC1_BLOCK)
+    out['c0'], out['c1'] = c0, c1
+    out['indices'] = (indices.astype(np.uint32) << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+    return out
+
+
+def encode_alpha_blocks(alpha):
+    """BC3 alpha blocks for (blocks, 16) float alpha values, in eight-value mode."""
+    a0 = alpha.max(axis=1).round().astype(np.uint8)
+    a1 = alpha.min(axis=1).round().astype(np.uint8)
+    weights = np.array([7, 0, 6, 5, 4, 3, 2, 1], dtype=np.float32) / 7
+    palette = weights * a0[:, None] + (1 - weights) * a1[:, None]
+    indices = np.abs(alpha[:, :, None] - palette[:, None, :]).argmin(axis=-1)
+    indices[a0 == a1] = 0
+
+    bits = (indices.astype(np.uint64) << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    out = np.empty(len(alpha), dtype=ALPHA_BLOCK)
+    out['a0'], out['a1'] = a0, a1
+    out['indices'] = ((bits[:, None] >> (8 * np.arange(6, dtype=np.uint64))) & 0xff).astype(np.uint8)
+    return out
+
+
+def encode_level(image, fmt='bc1', quality=BC_QUALITY):
+    """Block-compress one image level and return the raw block data."""
+    channels = 4 if fmt == 'bc3' else 3
+    pixels = np.asarray(image.convert('RGBA' if channels == 4 else 'RGB'))
+    blocks = to_blocks(pixels)
+    chunks = []
+    for start in range(0, len(blocks), BLOCK_CHUNK):
+        chunk = blocks[start:start + BLOCK_CHUNK].astype(np.float32)
+        color = encode_color_blocks(chunk[:, :, :3], quality)
+        if fmt == 'bc3':
+            out = np.empty(len(chunk), dtype=BC3_BLOCK)
+            out['alpha'] = encode_alpha_blocks(chunk[:, :, 3])
+            out['color'] = color
+            color = out
+        chunks.append(color.tobytes())
+    return b''.join(chunks)
+
+
+def dds_header(width, height, mip_count, fourcc, top_level_size):
+    # DDSD_CAPS | HEIGHT | WIDTH | PIXELFORMAT | MIPMAPCOUNT | LINEARSIZE
+    flags = 0x1 | 0x2 | 0x4 | 0x1000 | 0x20000 | 0x80000
+    # DDSCAPS_TEXTURE, plus COMPLEX | MIPMAP when there is more than one level
+    caps = 0x1000 | (0x8 | 0x400000 if mip_count > 1 else 0)
+    pixel_format = struct.pack('<II4s5I', 32, 0x4, fourcc, 0, 0, 0, 0, 0)
+    header = struct.pack('<7I', 124, flags, height, width, top_level_size, 0, mip_count)
+    return b'DDS ' + header + b'\0' * 44 + pixel_format + struct.pack('<5I', caps, 0, 0, 0, 0)
+
+
+def encode_dds(image, fmt='bc1', quality=BC_QUALITY):
+    """Encode ``image`` as a DDS file with a full mip chain down to 1x1 and return its bytes.
+
+    Levels are box-filtered from the level above, like the PNG/WebP pyramid,
+    and every level is block-compressed with the vectorized encoder.
+    """
+    if fmt not in BC_FORMATS:
+        raise ValueError(f"Unknown block compression format: {fmt}")
+    if quality not in BC_QUALITIES:
+        raise ValueError(f"Unknown block compression quality: {quality}")
+
+    level = image.convert('RGBA' if fmt == 'bc3' else 'RGB')
+    levels = []
+    while True:
+        levels.append(encode_level(level, fmt, quality))
+        if level.width == 1 and level.height == 1:
+            break
+        level = level.resize((max(1, level.width // 2), max(1, level.height // 2)), Image.BOX)
+
+    header = dds_header(image.width, image.height, len(levels), BC_FORMATS[fmt], len(levels[0]))
+    return header + b''.join(levels)
@@ -0,0 +1,130 @@
+import os
+import atexit
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import torch
+import metrics
+
+# Number of prompt embeddings kept in memory, and an optional file they are
+# persisted to so a restarted worker starts warm
+EMBEDDING_CACHE_SIZE = int(os.getenv('GENERATION_EMBEDDING_CACHE_SIZE', '256'))
+EMBEDDING_CACHE_PATH = os.getenv('GENERATION_EMBEDDING_CACHE_PATH', '')
+EMBEDDING_CACHE_SAVE_SECONDS = float(os.getenv('GENERATION_EMBEDDING_CACHE_SAVE_SECONDS', '60'))
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace and case. The CLIP tokenizer lowercases anyway, so
+    this never changes the embedding."""
+    return ' '.join(prompt.split()).lower()
+
+
+class PromptEmbeddingCache:
+    """LRU cache of CLIP text-encoder outputs keyed by model id and normalized prompt.
+
+    The worker passes the cached tensors to the pipeline as ``prompt_embeds``
+    and ``negative_prompt_embeds`` so repeated catalog prompts and the constant
+    negative prompt are only encoded once.
+    """
+
+    def __init__(self, pipe, model_id, max_entries=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH):
+        self.pipe = pipe
+        self.model_id = model_id
+        self.max_entries = max(1, max_entries)
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._encode_seconds = 0.0
+        self._encodes = 0
+        self._dirty = False
+        self._saved_at = time.time()
+
+        if self.path:
+            if os.path.exists(self.path):
+                self.load()
+            atexit.register(self.save)
+
+        metrics.register_gauge('embedding_cache_hit_rate',
+                               lambda: metrics.ratio('embedding_cache_hits', 'embedding_cache_lookups'))
+        metrics.register_gauge('embedding_cache_entries', lambda: len(self._entries))
+
+    def _key(self, prompt):
+        return (self.model_id, normalize_prompt(prompt))
+
+    def _encode(self, prompt):
+        start = time.perf_counter()
+        with torch.no_grad():
+            embeds, _ = self.pipe.encode_prompt(
+                prompt, self.pipe._execution_device, num_images_per_prompt=1, do_classifier_free_guidance=False)
+        elapsed = time.perf_counter() - start
+        self._encode_seconds += elapsed
+        self._encodes += 1
+        return embeds
+
+    def get(self, prompt):
+        """Embedding of ``prompt`` with shape (1, tokens, hidden), encoding it on a miss."""
+        key = self._key(prompt)
+        metrics.increment('embedding_cache_lookups')
+        with self._lock:
+            embeds = self._entries.get(key)
+            if embeds is not None:
+                self._entries.move_to_end(key)
+
+        if embeds is not None:
+            metrics.increment('embedding_cache_hits')
+            # Time saved is estimated from the average cost of a real encode
+            if self._encodes:
+                metrics.increment('embedding_cache_seconds_saved', self._encode_seconds / self._encodes)
+            return embeds.to(device=self.pipe._execution_device, dtype=self.pipe.text_encoder.dtype)
+
+        embeds = self._encode(prompt)
+        with self._lock:
+            self._entries[key] = embeds
+            self._dirty = True
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embeds
+
+    def encode_batch(self, prompts, negative_prompts):
+        """Stacked ``(prompt_embeds, negative_prompt_embeds)`` for a batch of jobs."""
+        prompt_embeds = torch.cat([self.get(prompt) for prompt in prompts])
+        negative_prompt_embeds = torch.cat([self.get(prompt) for prompt in negative_prompts])
+        return prompt_embeds, negative_prompt_embeds
+
+    def load(self):
+        """Load persisted embeddings for this model from ``path``."""
+        try:
+            stored = torch.load(self.path, map_location='cpu')
+        except Exception as e:
+            print(f"Could not load embedding cache from {self.path}: {str(e)}")
+            return
+        with self._lock:
+            for (model_id, prompt), embeds in stored.items():
+                if model_id == self.model_id:
+                    self._entries[(model_id, prompt)] = embeds
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        print(f"Loaded {len(self._entries)} prompt embeddings from {self.path}")
+
+    def maybe_save(self):
+        """Persist the cache at most once every EMBEDDING_CACHE_SAVE_SECONDS."""
+        if time.time() - self._saved_at >= EMBEDDING_CACHE_SAVE_SECONDS:
+            self.save()
+
+    def save(self):
+        """Persist the cache to ``path`` if it changed since the last save."""
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            stored = {key: embeds.detach().cpu() for key, embeds in self._entries.items()}
+            self._dirty = False
+            self._saved_at = time.time()
+
+        # Write to a temporary file first so a crash never leaves a truncated cache
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{self.path}.{uuid.uuid4().hex}.tmp'
+        torch.save(stored, tmp_path)
+        os.replace(tmp_path, self.path)
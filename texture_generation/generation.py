@@ -0,0 +1,655 @@
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+import hashlib
+import math
+from contextlib import nullcontext
+import torch
+from diffusers import StableDiffusionPipeline, StableDiffusionImg2ImgPipeline, DPMSolverMultistepScheduler
+from PIL import Image
+import metrics
+from cache import make_cache_key
+from previews import latents_to_image, encode_preview
+from tiling import set_circular_padding
+from sizing import region_sizes
+from upscale import get_upscaler, upscale_pool, UPSCALER
+from prompts import build_texture_prompt
+from scheduler import JobQueue, Preempted
+from admission import StepTimes
+from chunked import should_stream, upscale_strips, write_png, STREAM_OUTPUT_PIXELS
+from pyramid import build_pyramid, MIPS_ENABLED, MANIFEST_EXT
+
+# Generation settings
+MODEL_ID = os.getenv('GENERATION_MODEL_ID', 'runwayml/stable-diffusion-v1-5')
+DEFAULT_NEGATIVE_PROMPT = "blurry, low quality, distorted, unrealistic"
+
+# Largest number of prompts sent through the pipeline in one call. Lower this
+# if batched runs run out of memory.
+MAX_BATCH_SIZE = int(os.getenv('GENERATION_MAX_BATCH_SIZE', '4'))
+
+# How long the worker waits for more compatible jobs before running a batch
+BATCH_WAIT_SECONDS = float(os.getenv('GENERATION_BATCH_WAIT_SECONDS', '0.05'))
+
+# How long a request waits for its job before giving up
+JOB_TIMEOUT_SECONDS = float(os.getenv('GENERATION_JOB_TIMEOUT_SECONDS', '600'))
+
+# Seed used for catalog textures so their output is reproducible and cacheable
+CATALOG_SEED = int(os.getenv('GENERATION_CATALOG_SEED', '1234'))
+
+# How far img2img variants may move away from their base texture. Only about
+# ``strength * num_inference_steps`` denoising steps are run.
+VARIANT_STRENGTH = float(os.getenv('GENERATION_VARIANT_STRENGTH', '0.45'))
+
+# Where generated textures without a cache entry are written when they are
+# too large to return in memory
+GENERATED_DIR = os.path.join('static', 'generated_textures')
+
+# Device settings. ``auto`` uses CUDA when it is available and falls back to CPU.
+DEVICE = os.getenv('GENERATION_DEVICE', 'auto')
+
+# CPU inference settings: fp32 or bf16 weights, intra-op threads (0 = all
+# cores available to this process) and optional torch.compile of the UNet
+CPU_DTYPE = os.getenv('GENERATION_CPU_DTYPE', 'fp32')
+CPU_THREADS = int(os.getenv('GENERATION_CPU_THREADS', '0'))
+COMPILE_UNET = os.getenv('GENERATION_COMPILE_UNET', 'false').lower() == 'true'
+
+CPU_DTYPES = {
+    'fp32': torch.float32,
+    'bf16': torch.bfloat16
+}
+
+# Memory the pipeline's weights may take on the GPU (0 = no limit). Over the
+# budget the components are offloaded to the CPU and moved in as they run.
+MEMORY_BUDGET_MB = float(os.getenv('GENERATION_MEMORY_BUDGET_MB', '0'))
+
+# Pipeline components that hold (nearly all of) the weights
+PIPELINE_COMPONENTS = ('text_encoder', 'unet', 'vae')
+
+
+def resolve_device(device=None):
+    """Return 'cuda' or 'cpu' for the requested device setting."""
+    device = device or DEVICE
+    if device == 'auto':
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    if device == 'cuda' and not torch.cuda.is_available():
+        raise RuntimeError("GENERATION_DEVICE is 'cuda' but CUDA is not available")
+    return device
+
+
+# Named quality tiers. ``preview`` trades detail for latency with a fast
+# multistep solver at low resolution; ``final`` matches the original settings.
+# ``balanced`` runs diffusion at ``diffusion_size`` and upscales on the CPU to
+# ``size``, which is much cheaper than diffusing at full resolution.
+QUALITY_TIERS = {
+    'preview': {
+        'scheduler': 'dpmsolver++',
+        'num_inference_steps': 6,
+        'guidance_scale': 7.0,
+        'diffusion_size': 256,
+        'size': 256
+    },
+    'balanced': {
+        'scheduler': 'dpmsolver++',
+        'num_inference_steps': 20,
+        'guidance_scale': 7.5,
+        'diffusion_size': 384,
+        'size': 512
+    },
+    'final': {
+        'scheduler': 'default',
+        'num_inference_steps': 30,
+        'guidance_scale': 7.5,
+        'diffusion_size': 512,
+        'size': 512
+    }
+}
+
+# Tier used when a request does not ask for one, by job priority
+TIER_BY_PRIORITY = {
+    # CPU-only workers serve previews unless told otherwise
+    'interactive': os.getenv('GENERATION_DEFAULT_TIER', 'final' if resolve_device() == 'cuda' else 'preview'),
+    'catalog': 'final',
+    'prefetch': 'preview'
+}
+
+
+def make_scheduler(name, config):
+    """Build the named scheduler from the pipeline's scheduler config (None keeps the default)."""
+    if name == 'default':
+        return None
+    if name == 'dpmsolver++':
+        return DPMSolverMultistepScheduler.from_config(
+            config, algorithm_type='dpmsolver++', use_karras_sigmas=True)
+    raise ValueError(f"Unknown scheduler: {name}")
+
+
+def cpu_thread_count(threads=None):
+    """Number of intra-op threads to use for CPU inference."""
+    threads = threads if threads is not None else CPU_THREADS
+    if threads > 0:
+        return threads
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def component_bytes(module):
+    """Size of a module's parameters and buffers."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def choose_offload(pipe, memory_budget_mb):
+    """How to fit the pipeline into ``memory_budget_mb`` of GPU memory.
+
+    ``none`` keeps every component resident, ``model`` moves whole components
+    in as they run (the largest one must fit) and ``sequential`` streams
+    individual layers, which fits nearly any budget but is much slower.
+    """
+    if memory_budget_mb <= 0:
+        return 'none'
+    budget = memory_budget_mb * 2 ** 20
+    sizes = [component_bytes(getattr(pipe, name)) for name in PIPELINE_COMPONENTS]
+    if sum(sizes) <= budget:
+        return 'none'
+    if max(sizes) <= budget:
+        return 'model'
+    return 'sequential'
+
+
+def pipeline_dtype(device, cpu_dtype=None):
+    if device == 'cuda':
+        return torch.float16
+    cpu_dtype = cpu_dtype or CPU_DTYPE
+    if cpu_dtype not in CPU_DTYPES:
+        raise ValueError(f"Unknown CPU dtype: {cpu_dtype}")
+    return CPU_DTYPES[cpu_dtype]
+
+
+def load_pipeline(model_id=MODEL_ID, device=None, cpu_dtype=None, cpu_threads=None, compile_unet=None,
+                  memory_budget_mb=None):
+    """Load the Stable Diffusion pipeline used by the generation worker."""
+    device = resolve_device(device)
+    dtype = pipeline_dtype(device, cpu_dtype)
+    if device == 'cuda':
+        print("Loading pipeline on GPU")
+    else:
+        threads = cpu_thread_count(cpu_threads)
+        torch.set_num_threads(threads)
+        print(f"Loading pipeline on CPU ({cpu_dtype or CPU_DTYPE}, {threads} threads)")
+
+    pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=dtype)
+    place_pipeline(pipe, device, compile_unet=compile_unet, memory_budget_mb=memory_budget_mb)
+    return pipe
+
+
+def place_pipeline(pipe, device, compile_unet=None, memory_budget_mb=None):
+    """Move freshly loaded components to ``device`` and apply its optimizations.
+
+    Returns the offload mode used (see ``choose_offload``).
+    """
+    if compile_unet is None:
+        compile_unet = COMPILE_UNET
+    if memory_budget_mb is None:
+        memory_budget_mb = MEMORY_BUDGET_MB
+
+    offload = choose_offload(pipe, memory_budget_mb) if device == 'cuda' else 'none'
+    if offload == 'model':
+        print(f"Pipeline exceeds the {memory_budget_mb:.0f} MB budget, using model CPU offload")
+        pipe.enable_model_cpu_offload()
+    elif offload == 'sequential':
+        print(f"Pipeline exceeds the {memory_budget_mb:.0f} MB budget, using sequential CPU offload")
+        pipe.enable_sequential_cpu_offload()
+    else:
+        pipe.to(device)
+
+    if device == 'cpu':
+        # channels_last convolutions are faster with oneDNN; slicing bounds peak memory
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+        pipe.enable_attention_slicing()
+        pipe.enable_vae_slicing()
+
+        if compile_unet:
+            print("Compiling UNet with torch.compile")
+            pipe.unet = torch.compile(pipe.unet)
+    return offload
+
+
+class JobCancelled(Exception):
+    """Raised by ``GenerationJob.wait()`` when the job was cancelled or superseded."""
+
+
+class GenerationJob:
+    """A single texture generation request waiting for the worker."""
+
+    def __init__(self, prompt, negative_prompt=DEFAULT_NEGATIVE_PROMPT, tier=None, priority='interactive',
+                 num_inference_steps=None, guidance_scale=None, width=None, height=None, seed=None,
+                 tileable=False, preview_every=0):
+        self.priority = priority
+        self.tier = tier or TIER_BY_PRIORITY.get(priority, 'final')
+        if self.tier not in QUALITY_TIERS:
+            raise ValueError(f"Unknown quality tier: {self.tier}")
+        settings = QUALITY_TIERS[self.tier]
+
+        self.prompt = prompt
+        self.negative_prompt = negative_prompt or DEFAULT_NEGATIVE_PROMPT
+        self.scheduler = settings['scheduler']
+        self.num_inference_steps = num_inference_steps or settings['num_inference_steps']
+        self.guidance_scale = guidance_scale or settings['guidance_scale']
+        self.width = width or settings['diffusion_size']
+        self.height = height or settings['diffusion_size']
+        self.output_width = width or settings['size']
+        self.output_height = height or settings['size']
+        self.upscaler = UPSCALER
+
+        # img2img variants start from a cached base texture instead of noise
+        self.mode = 'txt2img'
+        self.init_image = None
+        self.base_key = None
+        self.strength = None
+        self.seed = seed
+        self.tileable = tileable
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.preemptions = 0
+        self.cancelled = False
+        self.finished_at = None
+        self.timings = {}
+        self.image = None
+        self.cache_path = None
+        self.mips = None
+        self.error = None
+        self._done = threading.Event()
+        self._finish_lock = threading.Lock()
+
+        # Progressive previews: a JPEG data URL every ``preview_every`` steps,
+        # followed by None once the job has finished
+        self.preview_every = preview_every
+        self.previews = queue.Queue() if preview_every else None
+        self.preview_seconds = 0.0
+
+    def fit_to_region(self, region_width, region_height):
+        """Size the job for a mask region instead of the tier's square default.
+
+        Small regions get small (cheap) renders. Regions larger than the tier
+        allows are generated at the cap and upscaled, unless the job is
+        tileable, in which case the tile is repeated over the region instead.
+        """
+        max_size = QUALITY_TIERS[self.tier]['diffusion_size']
+        width, height, output_width, output_height = region_sizes(region_width, region_height, max_size)
+        self.width, self.height = width, height
+        if self.tileable:
+            self.output_width, self.output_height = width, height
+        else:
+            self.output_width, self.output_height = output_width, output_height
+        return self
+
+    def as_variant(self, base_image, base_key, strength=VARIANT_STRENGTH):
+        """Turn this job into an img2img variant of ``base_image``.
+
+        ``base_key`` identifies the base texture (e.g. its cache path) so the
+        variant gets its own cache entry.
+        """
+        self.mode = 'img2img'
+        self.init_image = base_image.convert('RGB')
+        self.base_key = base_key
+        self.strength = strength
+        return self
+
+    def batch_key(self):
+        """Jobs with the same key can share one pipeline call."""
+        return (self.mode, self.strength, self.scheduler, self.num_inference_steps, self.guidance_scale,
+                self.width, self.height, self.tileable)
+
+    def cache_key(self):
+        """Key of this job's output in the generation cache, or None if it is not reproducible."""
+        if self.seed is None:
+            return None
+        return make_cache_key(
+            model_id=MODEL_ID,
+            tier=self.tier,
+            scheduler=self.scheduler,
+            prompt=self.prompt,
+            negative_prompt=self.negative_prompt,
+            num_inference_steps=self.num_inference_steps,
+            guidance_scale=self.guidance_scale,
+            width=self.width,
+            height=self.height,
+            output_width=self.output_width,
+            output_height=self.output_height,
+            upscaler=self.upscaler if (self.width, self.height) != (self.output_width, self.output_height) else None,
+            tileable=self.tileable,
+            mode=self.mode,
+            base_key=self.base_key,
+            strength=self.strength,
+            seed=self.seed
+        )
+
+    def finish(self, image=None, error=None, cache_path=None):
+        """Store the job's outcome. Only the first call counts, so a job cancelled
+        while its batch ran keeps its JobCancelled error."""
+        with self._finish_lock:
+            if self._done.is_set():
+                return False
+            self.image = image
+            self.error = error
+            self.cache_path = cache_path
+            self.finished_at = time.time()
+            self._done.set()
+        if self.previews is not None:
+            self.previews.put(None)
+        return True
+
+    def add_preview(self, step, latents):
+        """Decode an approximate preview from this job's intermediate latents."""
+        start = time.perf_counter()
+        self.previews.put({'step': step, 'image': encode_preview(latents_to_image(latents))})
+        self.preview_seconds += time.perf_counter() - start
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=JOB_TIMEOUT_SECONDS):
+        """Block until the worker has produced this job's image."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("Texture generation timed out")
+        if self.error is not None:
+            raise self.error
+        return self.image
+
+
+def default_seed(prompt, texture_id=None):
+    """Seed for a request without one: a stable function of its texture id and prompt.
+
+    Identical requests then produce identical images, on any node, and so
+    share a cache entry.
+    """
+    digest = hashlib.sha256(f'{texture_id}:{prompt}'.encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big')
+
+
+def catalog_job(texture, **kwargs):
+    """Build the job for a catalog ``Texture`` row, with its pinned seed unless one is given."""
+    kwargs.setdefault('seed', CATALOG_SEED)
+    return GenerationJob(
+        prompt=build_texture_prompt(texture),
+        negative_prompt=texture.negative_prompt,
+        **kwargs
+    )
+
+
+class GenerationWorker:
+    """Background thread that runs pending jobs through the pipeline in batches.
+
+    Jobs are taken from a ``JobQueue`` by (aged) priority, then in submission
+    order. That job decides the batch settings and up to ``max_batch_size``
+    compatible jobs are run with it as a single pipeline call; the images are
+    then routed back to their jobs. A background batch is preempted between
+    diffusion steps when more urgent work arrives and its jobs are requeued.
+    Seeded jobs are looked up in and written to ``cache`` when one is given.
+
+    Upscaling and caching run on ``postprocess_pool`` so the CPU work of one
+    batch overlaps with the diffusion of the next. With an ``embedding_cache``
+    the text encoder only runs for prompts it has not seen before. With a
+    ``residency`` manager every batch runs inside ``residency.use()``.
+    """
+
+    def __init__(self, pipe, max_batch_size=MAX_BATCH_SIZE, batch_wait=BATCH_WAIT_SECONDS, cache=None,
+                 postprocess_pool=upscale_pool, embedding_cache=None, class_caps=None, residency=None):
+        self.pipe = pipe
+        self.residency = residency
+        self.cache = cache
+        self.embedding_cache = embedding_cache
+        self.postprocess_pool = postprocess_pool
+        self.queue = JobQueue(max_batch_size, batch_wait, class_caps=class_caps)
+        self._thread = None
+        self._img2img_pipe = None
+        self._default_scheduler = pipe.scheduler
+        self._schedulers = {}
+        self._circular_padding = False
+        self._progress = 0.0
+        self._running = None
+        self.step_times = StepTimes()
+
+        metrics.register_gauge('generation_queue_length', lambda: len(self.queue))
+        if residency:
+            residency.on_unload(self._forget_components)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='generation-worker', daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, job):
+        """Queue a job and return it so the caller can wait on the result."""
+        key = job.cache_key()
+        cached_path = self.cache.get(key) if self.cache and key else None
+        if cached_path:
+            metrics.increment('generation_cache_hits')
+            # Opening only reads the header; large textures are served by path
+            image = Image.open(cached_path)
+            job.mips = self.cache.get_json(key, MANIFEST_EXT)
+            if MIPS_ENABLED and job.mips is None:
+                self.postprocess_pool.submit(self._backfill_mips, key, cached_path)
+            job.finish(image=None if should_stream(image.size) else image.convert('RGB'), cache_path=cached_path)
+            return job
+        if key:
+            metrics.increment('generation_cache_misses')
+
+        self.queue.put(job)
+        self.start()
+        return job
+
+    def cancel(self, job):
+        """Cancel a job that has not finished. Returns False if it already had.
+
+        A queued job is dropped. A running job's waiter returns right away and
+        its batch stops at the next step once every job in it is cancelled.
+        """
+        if job.done:
+            return False
+        job.cancelled = True
+        if self.queue.remove(job):
+            metrics.increment('generation_cancelled_jobs')
+        return job.finish(error=JobCancelled("Texture generation was cancelled"))
+
+    def promote(self, job, priority):
+        """Raise a job to ``priority`` if that is more urgent than its own."""
+        self.queue.promote(job, priority)
+
+    def running_batch(self):
+        """The batch currently on the pipeline (or None) and how far along it is."""
+        return self._running, self._progress
+
+    def _forget_components(self):
+        """Drop state tied to the current weights before the residency manager unloads them."""
+        self._img2img_pipe = None
+        self._circular_padding = False
+
+    def _pipeline_for(self, mode):
+        """Pipeline for a job mode; the img2img pipeline shares the loaded weights."""
+        if mode == 'img2img':
+            if self._img2img_pipe is None:
+                self._img2img_pipe = StableDiffusionImg2ImgPipeline(**self.pipe.components)
+            return self._img2img_pipe
+        return self.pipe
+
+    def _use_scheduler(self, pipe, name):
+        if name not in self._schedulers:
+            self._schedulers[name] = make_scheduler(name, self._default_scheduler.config) or self._default_scheduler
+        pipe.scheduler = self._schedulers[name]
+
+    def _use_circular_padding(self, enabled):
+        if enabled != self._circular_padding:
+            set_circular_padding(self.pipe, enabled)
+            self._circular_padding = enabled
+
+    def _run_batch(self, batch):
+        first = batch[0]
+        print(f"Generating batch of {len(batch)} texture(s) at tier {first.tier} ({first.mode})")
+        pipe = self._pipeline_for(first.mode)
+        self._use_scheduler(pipe, first.scheduler)
+        self._use_circular_padding(first.tileable)
+
+        # One generator per job so each image depends only on its own seed
+        generators = [
+            torch.Generator(device=self.pipe._execution_device).manual_seed(
+                job.seed if job.seed is not None else random.randrange(2 ** 32))
+            for job in batch
+        ]
+        started_at = time.time()
+        for job in batch:
+            job.started_at = started_at
+            job.timings['queue'] = started_at - job.submitted_at
+
+        prompts = [job.prompt for job in batch]
+        negative_prompts = [job.negative_prompt for job in batch]
+        if self.embedding_cache:
+            prompt_embeds, negative_prompt_embeds = self.embedding_cache.encode_batch(prompts, negative_prompts)
+            prompt_inputs = {'prompt_embeds': prompt_embeds, 'negative_prompt_embeds': negative_prompt_embeds}
+        else:
+            prompt_inputs = {'prompt': prompts, 'negative_prompt': negative_prompts}
+
+        if first.mode == 'img2img':
+            # img2img takes its size from the base image and skips the early steps
+            image_inputs = {
+                'image': [job.init_image.resize((job.width, job.height), Image.LANCZOS) for job in batch],
+                'strength': first.strength
+            }
+        else:
+            image_inputs = {'width': first.width, 'height': first.height}
+
+        with torch.no_grad():
+            images = pipe(
+                **prompt_inputs,
+                **image_inputs,
+                num_inference_steps=first.num_inference_steps,
+                guidance_scale=first.guidance_scale,
+                generator=generators,
+                callback_on_step_end=self._step_callback(batch)
+            ).images
+        diffusion_seconds = time.time() - started_at
+        self.step_times.record(first.tier, diffusion_seconds, getattr(pipe, 'num_timesteps', None)
+                               or first.num_inference_steps)
+        metrics.increment('generation_batches')
+        metrics.increment('generation_jobs', len(batch))
+        if self.embedding_cache:
+            self.embedding_cache.maybe_save()
+        for job, image in zip(batch, images):
+            job.timings['diffusion'] = diffusion_seconds
+            self.postprocess_pool.submit(self._postprocess, job, image)
+
+    def _postprocess(self, job, image):
+        """Upscale a generated image to the job's output size and store it in the cache.
+
+        Outputs too large to hold in memory (see ``chunked.should_stream``)
+        finish with ``image=None`` and only a file path. Cached outputs also
+        get their mip pyramid written.
+        """
+        try:
+            start = time.time()
+            source = image
+            size = (job.output_width, job.output_height)
+            key = job.cache_key()
+            if image.size != size and should_stream(size):
+                # Large outputs are upscaled and encoded strip by strip straight to
+                # disk; the job then only carries the file path
+                strips = upscale_strips(image, size, job.upscaler)
+                if self.cache and key:
+                    cache_path = self.cache.put_strips(key, size, strips)
+                else:
+                    os.makedirs(GENERATED_DIR, exist_ok=True)
+                    cache_path = write_png(os.path.join(GENERATED_DIR, f'{uuid.uuid4()}.png'), size, strips)
+                image = None
+            else:
+                if image.size != size:
+                    image = get_upscaler(job.upscaler)(image, size)
+                cache_path = self.cache.put(key, image) if self.cache and key else None
+            job.timings['upscale'] = time.time() - start
+
+            if MIPS_ENABLED and cache_path and key:
+                start = time.time()
+                job.mips = build_pyramid(self.cache, key, size, source, image=image, upscaler=job.upscaler)
+                job.timings['mips'] = time.time() - start
+            job.finish(image=image, cache_path=cache_path)
+        except Exception as e:
+            print("Error post-processing generated texture:", str(e))
+            job.finish(error=e)
+
+    def _backfill_mips(self, key, path):
+        """Build the mip pyramid of a texture that was cached before it had one.
+
+        Textures too large to hold in memory are only kept as a copy reduced
+        below STREAM_OUTPUT_PIXELS, which the levels are resampled from; their
+        level 0 stays the cached file.
+        """
+        try:
+            with Image.open(path) as stored:
+                size = stored.size
+                if should_stream(size):
+                    factor = math.ceil(math.sqrt(size[0] * size[1] / STREAM_OUTPUT_PIXELS))
+                    source, image = stored.reduce(factor).convert('RGB'), None
+                else:
+                    source = image = stored.convert('RGB')
+            build_pyramid(self.cache, key, size, source, image=image)
+        except Exception as e:
+            print("Error building mip levels:", str(e))
+
+    def _step_callback(self, batch):
+        """Pipeline step callback that sends previews and preempts background batches."""
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            progress = (step + 1) / max(1, getattr(pipe, 'num_timesteps', None) or batch[0].num_inference_steps)
+            self._progress = progress
+            if all(job.cancelled for job in batch):
+                raise JobCancelled("Texture generation was cancelled")
+            if self.queue.should_preempt(batch, progress):
+                raise Preempted()
+
+            latents = callback_kwargs['latents']
+            for index, job in enumerate(batch):
+                # Skip the last step; the finished image follows right after it
+                if job.preview_every and (step + 1) % job.preview_every == 0 \
+                        and step + 1 < job.num_inference_steps:
+                    job.add_preview(step + 1, latents[index])
+            return callback_kwargs
+
+        return on_step_end
+
+    def _run(self):
+        while True:
+            batch = self.queue.take_batch()
+            if not batch:
+                continue
+            self._progress = 0.0
+            self._running = batch
+            try:
+                with self.residency.use() if self.residency else nullcontext():
+                    self._run_batch(batch)
+            except JobCancelled:
+                # Every waiter is gone; estimate the remaining steps that were skipped
+                elapsed = time.time() - batch[0].started_at
+                reclaimed = elapsed * (1 - self._progress) / max(self._progress, 1e-6)
+                print(f"Cancelled batch of {len(batch)} texture(s) at {self._progress:.0%}")
+                metrics.increment('generation_cancelled_runs')
+                metrics.increment('generation_cancelled_jobs', len(batch))
+                metrics.increment('generation_reclaimed_seconds', reclaimed)
+            except Preempted:
+                # The batch starts over later; the steps it ran so far are lost
+                started_at = batch[0].started_at
+                print(f"Preempted batch of {len(batch)} {batch[0].priority} texture(s)")
+                metrics.increment('generation_preemptions')
+                metrics.increment('generation_preempted_jobs', len(batch))
+                metrics.increment('generation_preempted_seconds', time.time() - started_at)
+                self.queue.requeue([job for job in batch if not job.done])
+            except Exception as e:
+                print("Error in generation batch:", str(e))
+                for job in batch:
+                    job.finish(error=e)
+            finally:
+                self._running = None
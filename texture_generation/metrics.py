@@ -0,0 +1,36 @@
+import threading
+from collections import defaultdict
+
+# Process-wide counters exported at /api/metrics
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+
+
+def increment(name, value=1):
+    """Add ``value`` to the counter ``name``."""
+    with _lock:
+        _counters[name] += value
+
+
+def register_gauge(name, read):
+    """Export the value returned by ``read()`` as ``name`` on every snapshot."""
+    with _lock:
+        _gauges[name] = read
+
+
+def ratio(numerator, denominator):
+    """Ratio of two counters, 0.0 while the denominator is still zero."""
+    with _lock:
+        total = _counters[denominator]
+        return _counters[numerator] / total if total else 0.0
+
+
+def snapshot():
+    """Current value of every counter and gauge."""
+    with _lock:
+        values = dict(_counters)
+        gauges = dict(_gauges)
+    for name, read in gauges.items():
+        values[name] = read()
+    return values
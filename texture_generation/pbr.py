@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+PBR_MAPS = ('height', 'normal', 'roughness', 'ao')
+
+# Rec. 709 luma weights
+LUMA = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+# Defaults, relative to the texture size where a size is involved
+NORMAL_STRENGTH = 4.0
+HEIGHT_BLUR = 1 / 512
+AO_RADIUS = 1 / 32
+AO_STRENGTH = 2.5
+ROUGHNESS_RADIUS = 1 / 128
+
+
+def _pad_mode(tileable):
+    # Tileable textures wrap around, so their maps must too
+    return 'wrap' if tileable else 'edge'
+
+
+def blur(values, sigma, tileable=False):
+    """Gaussian blur of a 2D float array; ``tileable`` blurs across the wrapped edges."""
+    if sigma <= 0:
+        return values
+    pad = int(np.ceil(3 * sigma))
+    padded = np.pad(values, pad, mode=_pad_mode(tileable))
+    blurred = cv2.GaussianBlur(padded, (0, 0), sigma, borderType=cv2.BORDER_REFLECT)
+    return blurred[pad:-pad, pad:-pad]
+
+
+def sobel(values, tileable=False):
+    """Horizontal and vertical Sobel gradients of a 2D array, computed with array shifts."""
+    p = np.pad(values, 1, mode=_pad_mode(tileable))
+    # Rows above/below and columns left/right of every pixel
+    top, middle, bottom = p[:-2], p[1:-1], p[2:]
+    dx = (top[:, 2:] + 2 * middle[:, 2:] + bottom[:, 2:]) - (top[:, :-2] + 2 * middle[:, :-2] + bottom[:, :-2])
+    left, center, right = p[:, :-2], p[:, 1:-1], p[:, 2:]
+    dy = (left[2:] + 2 * center[2:] + right[2:]) - (left[:-2] + 2 * center[:-2] + right[:-2])
+    return dx / 8, dy / 8
+
+
+def height_map(rgb, tileable=False):
+    """Height in 0-1 from luminance, lightly blurred so noise does not read as relief."""
+    luminance = rgb @ LUMA
+    height = blur(luminance, HEIGHT_BLUR * max(rgb.shape[:2]), tileable)
+    low, high = height.min(), height.max()
+    return (height - low) / max(high - low, 1e-6)
+
+
+def normal_map(height, strength=NORMAL_STRENGTH, tileable=False):
+    """Tangent-space normals (OpenGL convention, +Y up) from a height map, in -1..1."""
+    dx, dy = sobel(height, tileable)
+    # Gradients are per pixel; scale them so relief does not depend on resolution
+    scale = strength * max(height.shape) / 512
+    normals = np.dstack([-dx * scale, dy * scale, np.ones_like(height)])
+    return normals / np.linalg.norm(normals, axis=2, keepdims=True)
+
+
+def roughness_map(rgb, height, tileable=False):
+    """Roughness in 0-1: darker and locally busier areas are treated as rougher."""
+    luminance = rgb @ LUMA
+    sigma = ROUGHNESS_RADIUS * max(rgb.shape[:2])
+    mean = blur(height, sigma, tileable)
+    variance = np.maximum(blur(height * height, sigma, tileable) - mean * mean, 0)
+    return np.clip(0.35 + 0.4 * (1 - luminance) + 1.5 * np.sqrt(variance), 0, 1)
+
+
+def ao_map(height, tileable=False):
+    """Ambient occlusion in 0-1: cavities lower than their surroundings get darker."""
+    surroundings = blur(height, AO_RADIUS * max(height.shape), tileable)
+    return np.clip(1 - AO_STRENGTH * np.maximum(surroundings - height, 0), 0, 1)
+
+
+def derive_pbr_maps(image, tileable=False):
+    """Height, normal, roughness and AO maps of an albedo texture, as PIL images.
+
+    Height is a 16-bit grayscale PNG; the others are 8-bit, with normals
+    packed into RGB as ``(n + 1) / 2``.
+    """
+    rgb = np.asarray(image.convert('RGB'), dtype=np.float32) / 255.0
+    height = height_map(rgb, tileable)
+    normals = normal_map(height, tileable=tileable)
+    roughness = roughness_map(rgb, height, tileable)
+    ao = ao_map(height, tileable)
+
+    return {
+        'height': Image.fromarray((height * 65535 + 0.5).astype(np.uint16)),
+        'normal': Image.fromarray(((normals + 1) * 127.5 + 0.5).astype(np.uint8)),
+        'roughness': Image.fromarray((roughness * 255 + 0.5).astype(np.uint8)),
+        'ao': Image.fromarray((ao * 255 + 0.5).astype(np.uint8))
+    }
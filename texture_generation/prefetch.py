@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+import metrics
+
+# Catalog textures prefetched per detected material category, the most
+# prefetch jobs one session may have outstanding, and how long a session may
+# be idle before it is treated as gone
+PREFETCH_TOP_N = int(os.getenv('GENERATION_PREFETCH_TOP_N', '3'))
+PREFETCH_MAX_PER_SESSION = int(os.getenv('GENERATION_PREFETCH_MAX_PER_SESSION', '12'))
+PREFETCH_SESSION_TTL_SECONDS = float(os.getenv('GENERATION_PREFETCH_SESSION_TTL_SECONDS', '900'))
+
+
+class Prefetcher:
+    """Speculatively generates textures a session is likely to apply next.
+
+    After segmentation the caller queues low-priority catalog jobs for the
+    detected categories. When the user then applies one of them, the request
+    either hits the cache or joins the in-flight prefetch job. Prefetch work is
+    bounded per session and dropped when the session ends or goes idle.
+    """
+
+    def __init__(self, worker, max_per_session=PREFETCH_MAX_PER_SESSION, ttl=PREFETCH_SESSION_TTL_SECONDS):
+        self.worker = worker
+        self.max_per_session = max_per_session
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+        metrics.register_gauge('prefetch_hit_rate', lambda: metrics.ratio('prefetch_hits', 'prefetch_jobs'))
+        metrics.register_gauge('prefetch_active_sessions', lambda: len(self._sessions))
+
+    def prefetch(self, session_id, jobs):
+        """Queue ``jobs`` for ``session_id``, replacing its earlier prefetches."""
+        if not session_id:
+            return 0
+        self.expire()
+        self.end_session(session_id)
+
+        session = {'jobs': {}, 'used': set(), 'last_seen': time.time()}
+        for job in jobs[:self.max_per_session]:
+            key = job.cache_key()
+            if key and key not in session['jobs']:
+                session['jobs'][key] = self.worker.submit(job)
+        with self._lock:
+            self._sessions[session_id] = session
+        metrics.increment('prefetch_jobs', len(session['jobs']))
+        return len(session['jobs'])
+
+    def has(self, session_id, job):
+        """Whether ``claim`` would return a prefetched job for ``job``."""
+        key = job.cache_key()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id and key else None
+            prefetched = session['jobs'].get(key) if session else None
+        return prefetched is not None and not (prefetched.done and prefetched.error is not None)
+
+    def claim(self, session_id, job):
+        """Return the prefetched job matching ``job`` if there is one, else None.
+
+        A prefetched job that is still queued is promoted to ``job``'s priority
+        so the user does not wait behind other background work.
+        """
+        key = job.cache_key()
+        if not session_id or not key:
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if not session:
+                return None
+            session['last_seen'] = time.time()
+            prefetched = session['jobs'].get(key)
+            # A prefetch cancelled by an earlier, superseded request is generated again
+            if prefetched is None or (prefetched.done and prefetched.error is not None):
+                return None
+            first_use = key not in session['used']
+            session['used'].add(key)
+
+        if first_use:
+            metrics.increment('prefetch_hits')
+        if not prefetched.done:
+            self.worker.promote(prefetched, job.priority)
+        return prefetched
+
+    def end_session(self, session_id):
+        """Drop a session's queued prefetches and account for unused work."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if not session:
+            return
+        for key, job in session['jobs'].items():
+            if key in session['used']:
+                continue
+            if job.done:
+                # Generated for nothing (cache hits at submit time cost nothing)
+                if 'diffusion' in job.timings:
+                    metrics.increment('prefetch_wasted_jobs')
+                    metrics.increment('prefetch_wasted_seconds', job.timings['diffusion'])
+            elif self.worker.cancel(job):
+                metrics.increment('prefetch_dropped_jobs')
+
+    def expire(self):
+        """End sessions that have been idle for longer than the TTL."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [session_id for session_id, session in self._sessions.items()
+                       if session['last_seen'] < cutoff]
+        for session_id in expired:
+            self.end_session(session_id)
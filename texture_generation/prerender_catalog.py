@@ -0,0 +1,77 @@
+"""Pre-render every catalog texture into the generation cache.
+
+Each ``Texture`` row is generated once with the pinned catalog seed so that
+clicks on catalog textures in /api/generate-texture become cache hits.
+
+    python prerender_catalog.py                                 # whole catalog
+    python prerender_catalog.py --num-workers 2 --worker-index 0  # shard 0 of 2
+
+Textures that are already cached are skipped, so an interrupted run can simply
+be started again. Shards split the catalog by texture id, which lets several
+processes (or machines sharing the cache directory) render in parallel.
+"""
+import argparse
+import os
+from app import app, db, Texture, generation_cache, generation_worker
+from generation import catalog_job, MAX_BATCH_SIZE, QUALITY_TIERS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pre-render catalog textures into the generation cache')
+    parser.add_argument('--num-workers', type=int, default=1, help='Total number of parallel workers')
+    parser.add_argument('--worker-index', type=int, default=0, help='Index of this worker (0-based)')
+    parser.add_argument('--chunk-size', type=int, default=MAX_BATCH_SIZE * 2,
+                        help='Number of textures queued at once so they can be batched')
+    parser.add_argument('--tier', choices=sorted(QUALITY_TIERS), default='final', help='Quality tier to render')
+    parser.add_argument('--force', action='store_true', help='Regenerate textures that are already cached')
+    return parser.parse_args()
+
+
+def record_path(texture, path):
+    if texture.generated_texture_path != path:
+        texture.generated_texture_path = path
+        db.session.commit()
+
+
+def prerender(num_workers=1, worker_index=0, chunk_size=MAX_BATCH_SIZE * 2, tier='final', force=False):
+    textures = Texture.query.order_by(Texture.id).all()
+    shard = [t for t in textures if t.id % num_workers == worker_index]
+    print(f"Worker {worker_index}/{num_workers}: {len(shard)} of {len(textures)} textures")
+
+    # Resume: anything already in the cache only needs its path recorded
+    todo = []
+    for texture in shard:
+        job = catalog_job(texture, tier=tier, priority='catalog')
+        cached_path = generation_cache.get(job.cache_key())
+        if cached_path and not force:
+            record_path(texture, cached_path)
+            print(f"Cached: {texture.name}")
+        else:
+            if cached_path:
+                os.remove(cached_path)
+            todo.append(texture)
+
+    generated = 0
+    for start in range(0, len(todo), chunk_size):
+        chunk = todo[start:start + chunk_size]
+
+        # Submit the whole chunk before waiting so the worker can batch it
+        jobs = [(texture, generation_worker.submit(catalog_job(texture, tier=tier, priority='catalog'))) for texture in chunk]
+        for texture, job in jobs:
+            try:
+                job.wait()
+                record_path(texture, job.cache_path)
+                generated += 1
+                print(f"Generated: {texture.name} -> {job.cache_path}")
+            except Exception as e:
+                print(f"Error generating {texture.name}: {str(e)}")
+
+    print(f"Done: {generated} generated, {len(shard) - len(todo)} already cached")
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not 0 <= args.worker_index < args.num_workers:
+        raise SystemExit('--worker-index must be between 0 and --num-workers - 1')
+    with app.app_context():
+        prerender(args.num_workers, args.worker_index, args.chunk_size, args.tier, args.force)
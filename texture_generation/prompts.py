@@ -0,0 +1,72 @@
+import os
+import re
+import json
+import threading
+import time
+
+# Optional JSONL log of incoming prompts, used to measure canonicalization
+PROMPT_LOG_PATH = os.getenv('GENERATION_PROMPT_LOG', '')
+
+# Templates the frontend and older backend versions wrap descriptions in.
+# They all mean "a texture for <part> that looks like <description>".
+TEMPLATE_PATTERNS = [
+    re.compile(r'^(?:generate|create|make)\s+(?:a\s+)?(?:seamless\s+)?texture\s+for\s+(?:the\s+|a\s+)?'
+               r'(?P<part>[\w\s-]+?)\s+with\s+(?:these|the\s+following)\s+characteristics\s*:\s*'
+               r'(?P<description>.+)$'),
+    re.compile(r'^(?:a\s+)?seamless\s+texture\s+for\s+(?P<part>[\w\s-]+?)\s*[,:]\s*(?P<description>.+)$')
+]
+
+_log_lock = threading.Lock()
+
+
+def build_texture_prompt(texture):
+    """Prompt for a catalog texture, falling back to its description when it has no prompt."""
+    if texture.prompt:
+        return canonicalize_prompt(texture.prompt)
+    return canonicalize_prompt(f"seamless texture, {texture.description}")
+
+
+def canonical_template(part, description):
+    return f"seamless texture for {normalize_text(part)}, {normalize_text(description)}"
+
+
+def normalize_text(text):
+    """Lowercase, unify punctuation and whitespace, drop trailing punctuation."""
+    text = text.lower().replace('’', "'")
+    text = re.sub(r'[;|/]+', ',', text)
+    text = re.sub(r'(?<!\b\w)[!?.]+(?=\s|$)', ',', text)
+    text = re.sub(r'\s*,[\s,]*', ', ', text)
+    text = ' '.join(text.split())
+    return text.strip(' ,:.')
+
+
+def canonicalize_prompt(prompt):
+    """Canonical form of a free-form prompt, used both to generate and as cache key.
+
+    Prompts that only differ in whitespace, case, punctuation or which prompt
+    template wraps the description map to the same string.
+    """
+    text = ' '.join(prompt.split())
+    lowered = text.lower()
+    for pattern in TEMPLATE_PATTERNS:
+        match = pattern.match(lowered)
+        if match:
+            return canonical_template(match.group('part'), match.group('description'))
+    return normalize_text(text)
+
+
+def log_prompt_request(data, prompt):
+    """Append a generate request's raw and canonical prompt to the prompt log."""
+    if not PROMPT_LOG_PATH:
+        return
+    entry = {
+        'time': time.time(),
+        'textureId': data.get('textureId'),
+        'maskClass': data.get('maskClass'),
+        'prompt': data.get('prompt'),
+        'textureDescription': data.get('textureDescription'),
+        'canonicalPrompt': prompt
+    }
+    with _log_lock:
+        with open(PROMPT_LOG_PATH, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
@@ -0,0 +1,65 @@
+import os
+from PIL import Image
+from chunked import should_stream, upscale_strips
+from upscale import get_upscaler
+
+# Every cached texture gets mip levels (full size, 1/2, 1/4, ...) down to
+# MIP_MIN_SIZE on its longest side, each as PNG and WebP
+MIPS_ENABLED = os.getenv('GENERATION_MIPS', 'true').lower() == 'true'
+MIP_MIN_SIZE = int(os.getenv('GENERATION_MIP_MIN_SIZE', '64'))
+MIP_WEBP_QUALITY = int(os.getenv('GENERATION_MIP_WEBP_QUALITY', '90'))
+
+MANIFEST_EXT = 'mips.json'
+
+
+def mip_sizes(width, height, min_size=MIP_MIN_SIZE):
+    """Sizes of the mip chain, halving each side until the longest is at most ``min_size``."""
+    sizes = [(width, height)]
+    while max(sizes[-1]) > min_size and min(sizes[-1]) > 1:
+        level_width, level_height = sizes[-1]
+        sizes.append((max(1, level_width // 2), max(1, level_height // 2)))
+    return sizes
+
+
+def level_key(key, level):
+    # Level 0 is the texture's own cache entry
+    return key if level == 0 else f'{key}-mip{level}'
+
+
+def build_pyramid(cache, key, size, source, image=None, upscaler=None):
+    """Write the mip levels of the cached texture ``key`` and return its manifest.
+
+    ``source`` is the diffusion output and ``image`` the full-size texture
+    when it is held in memory. Each level is box-filtered from the level
+    above it, so the chain is resampled once. Levels too large to hold in
+    memory (see ``chunked``) are resampled from ``source`` strip by strip and
+    only written as PNG, as is level 0 of such textures.
+    """
+    levels = []
+    previous = image
+    for level, level_size in enumerate(mip_sizes(*size)):
+        entry = {'level': level, 'width': level_size[0], 'height': level_size[1]}
+        if level == 0:
+            current = image
+        elif previous is not None:
+            current = previous.resize(level_size, Image.BOX)
+        elif should_stream(level_size):
+            current = None
+        else:
+            current = get_upscaler(upscaler)(source, level_size)
+
+        lkey = level_key(key, level)
+        if level == 0:
+            entry['png'] = cache.path_for(key)
+        elif current is None:
+            entry['png'] = cache.put_strips(lkey, level_size, upscale_strips(source, level_size, upscaler))
+        else:
+            entry['png'] = cache.put(lkey, current)
+        if current is not None:
+            entry['webp'] = cache.put(lkey, current, 'webp', quality=MIP_WEBP_QUALITY)
+        levels.append(entry)
+        previous = current
+
+    manifest = {'key': key, 'levels': levels}
+    cache.put_json(key, manifest, MANIFEST_EXT)
+    return manifest
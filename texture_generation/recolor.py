@@ -0,0 +1,72 @@
+import re
+import cv2
+import numpy as np
+from PIL import Image
+
+RECOLOR_MODES = ('transfer', 'tint')
+
+HEX_COLOR = re.compile(r'^#?([0-9a-fA-F]{6})$')
+
+
+def parse_color(value):
+    """Parse '#rrggbb' or an [r, g, b] list into an RGB tuple."""
+    if isinstance(value, str):
+        match = HEX_COLOR.match(value.strip())
+        if not match:
+            raise ValueError(f"Invalid color: {value}")
+        hex_value = match.group(1)
+        return tuple(int(hex_value[i:i + 2], 16) for i in (0, 2, 4))
+    if isinstance(value, (list, tuple)) and len(value) == 3:
+        return tuple(max(0, min(255, int(channel))) for channel in value)
+    raise ValueError(f"Invalid color: {value}")
+
+
+def rgb_to_lab(pixels):
+    """float32 RGB in 0-1 (any shape ending in 3) to Lab with L in 0-100."""
+    shape = pixels.shape
+    lab = cv2.cvtColor(pixels.reshape(-1, 1, 3).astype(np.float32), cv2.COLOR_RGB2LAB)
+    return lab.reshape(shape)
+
+
+def lab_to_rgb(lab):
+    shape = lab.shape
+    rgb = cv2.cvtColor(lab.reshape(-1, 1, 3).astype(np.float32), cv2.COLOR_LAB2RGB)
+    return rgb.reshape(shape)
+
+
+def palette_stats(colors):
+    """Mean and spread of a palette in Lab space."""
+    lab = rgb_to_lab(np.array(colors, dtype=np.float32) / 255.0)
+    return lab.mean(axis=0), lab.std(axis=0)
+
+
+def recolor(image, colors, mode='transfer'):
+    """Recolor ``image`` towards a target color or palette.
+
+    ``transfer`` matches the Lab mean (and, for palettes, the spread) of the
+    texture to the target, Reinhard-style, while keeping the texture's own
+    lightness variation. ``tint`` keeps lightness exactly and only moves the
+    chroma channels, which suits metals and other low-saturation textures.
+    """
+    if mode not in RECOLOR_MODES:
+        raise ValueError(f"Unknown recolor mode: {mode}")
+
+    rgb = np.asarray(image.convert('RGB'), dtype=np.float32) / 255.0
+    lab = rgb_to_lab(rgb)
+    mean = lab.reshape(-1, 3).mean(axis=0)
+    std = lab.reshape(-1, 3).std(axis=0) + 1e-6
+    target_mean, target_std = palette_stats(colors)
+
+    if mode == 'tint':
+        result = lab.copy()
+        result[..., 1:] = lab[..., 1:] - mean[1:] + target_mean[1:]
+    else:
+        # A single color has no spread; keep the texture's own variation then
+        scale = np.where(target_std > 1e-3, target_std / std, 1.0)
+        scale[0] = 1.0 if len(colors) == 1 else scale[0]
+        result = (lab - mean) * scale + target_mean
+
+    result[..., 0] = np.clip(result[..., 0], 0, 100)
+    result[..., 1:] = np.clip(result[..., 1:], -127, 127)
+    out = np.clip(lab_to_rgb(result) * 255.0 + 0.5, 0, 255).astype(np.uint8)
+    return Image.fromarray(out)
@@ -0,0 +1,139 @@
+import os
+import gc
+import threading
+import time
+from contextlib import contextmanager
+import torch
+from diffusers import StableDiffusionPipeline
+import metrics
+from generation import (MODEL_ID, MEMORY_BUDGET_MB, PIPELINE_COMPONENTS, QUALITY_TIERS, TIER_BY_PRIORITY,
+                        component_bytes, choose_offload, place_pipeline, resolve_device)
+
+# Drop the weights after this many idle seconds (0 keeps them loaded). The
+# next batch reloads them and runs a one-step warm-up first.
+IDLE_UNLOAD_SECONDS = float(os.getenv('GENERATION_IDLE_UNLOAD_SECONDS', '0'))
+
+
+class ModelResidency:
+    """Keeps the pipeline's weights within a memory budget and unloads them when idle.
+
+    The worker runs every batch inside ``use()``, which reloads unloaded
+    weights first. A monitor thread unloads the text encoder, UNet and VAE
+    once nothing has used them for ``idle_unload_seconds``; the pipeline
+    object itself stays, so everything holding a reference to it keeps
+    working. Per-component weight sizes are exported as metrics, and on CUDA
+    so is each component's high-water mark (peak allocation while it ran).
+    CPU has no per-component equivalent, only the process-wide RSS, so no
+    peak is reported there.
+    """
+
+    def __init__(self, pipe, model_id=MODEL_ID, device=None, memory_budget_mb=MEMORY_BUDGET_MB,
+                 idle_unload_seconds=IDLE_UNLOAD_SECONDS):
+        self.pipe = pipe
+        self.model_id = model_id
+        self.device = resolve_device(device)
+        self.dtype = pipe.unet.dtype
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_unload_seconds = idle_unload_seconds
+        self.offload = choose_offload(pipe, memory_budget_mb) if self.device == 'cuda' else 'none'
+        self.resident = True
+        self._busy = 0
+        self._last_used = time.time()
+        self._lock = threading.Lock()
+        self._unload_callbacks = []
+        self._weights = {}
+        self._peaks = {}
+        self._track_memory()
+
+        metrics.register_gauge('model_resident', lambda: self.resident)
+        metrics.register_gauge('model_offload', lambda: self.offload)
+        metrics.register_gauge('model_memory_mb', self.memory_report)
+
+        if self.idle_unload_seconds > 0:
+            threading.Thread(target=self._monitor, name='model-residency', daemon=True).start()
+
+    def on_unload(self, callback):
+        """Call ``callback()`` before the components are dropped, e.g. to forget pipelines sharing them."""
+        self._unload_callbacks.append(callback)
+
+    @contextmanager
+    def use(self):
+        """Hold the weights loaded for the duration of a pipeline call."""
+        with self._lock:
+            if not self.resident:
+                self._reload()
+            self._busy += 1
+        try:
+            yield self.pipe
+        finally:
+            with self._lock:
+                self._busy -= 1
+                self._last_used = time.time()
+
+    def memory_report(self):
+        """Weight size, and on CUDA high-water mark, of each component in MB."""
+        report = {name: {'weights': self._weights.get(name, 0) / 2 ** 20} for name in PIPELINE_COMPONENTS}
+        if self.device == 'cuda':
+            for name in PIPELINE_COMPONENTS:
+                report[name]['peak'] = self._peaks.get(name, 0) / 2 ** 20
+        return report
+
+    def _track_memory(self):
+        for name in PIPELINE_COMPONENTS:
+            module = getattr(self.pipe, name)
+            self._weights[name] = component_bytes(module)
+            if self.device != 'cuda':
+                continue
+            # The VAE runs through encode()/decode(), which bypass its own forward hooks
+            targets = [module.encoder, module.decoder] if name == 'vae' else [module]
+            for target in targets:
+                target.register_forward_pre_hook(self._start_measurement)
+                target.register_forward_hook(lambda *args, name=name: self._record_peak(name))
+
+    def _start_measurement(self, *args):
+        torch.cuda.reset_peak_memory_stats()
+
+    def _record_peak(self, name):
+        peak = torch.cuda.max_memory_allocated()
+        if peak > self._peaks.get(name, 0):
+            self._peaks[name] = peak
+
+    def _monitor(self):
+        while True:
+            time.sleep(min(self.idle_unload_seconds, 30))
+            with self._lock:
+                idle = time.time() - self._last_used
+                if self.resident and not self._busy and idle >= self.idle_unload_seconds:
+                    self._unload()
+
+    def _unload(self):
+        print(f"Unloading pipeline weights after {self.idle_unload_seconds:.0f}s idle")
+        for callback in self._unload_callbacks:
+            callback()
+        if self.offload != 'none':
+            self.pipe.remove_all_hooks()
+        self.pipe.register_modules(**{name: None for name in PIPELINE_COMPONENTS})
+        self.resident = False
+        gc.collect()
+        if self.device == 'cuda':
+            torch.cuda.empty_cache()
+        metrics.increment('model_unloads')
+
+    def _reload(self):
+        start = time.time()
+        print("Reloading pipeline weights")
+        fresh = StableDiffusionPipeline.from_pretrained(self.model_id, torch_dtype=self.dtype)
+        self.pipe.register_modules(**{name: getattr(fresh, name) for name in PIPELINE_COMPONENTS})
+        del fresh
+        self.offload = place_pipeline(self.pipe, self.device, memory_budget_mb=self.memory_budget_mb)
+        self._track_memory()
+        self.resident = True
+
+        # One small step through every component pays for lazy initialization
+        # (cuDNN autotuning, torch.compile) before a user is waiting on it
+        size = QUALITY_TIERS[TIER_BY_PRIORITY['interactive']]['diffusion_size']
+        with torch.no_grad():
+            self.pipe(prompt='', num_inference_steps=1, width=size, height=size)
+        print(f"Reloaded pipeline in {time.time() - start:.1f}s")
+        metrics.increment('model_reloads')
+        metrics.increment('model_reload_seconds', time.time() - start)
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+
+# Job priorities, most urgent first
+PRIORITIES = ('interactive', 'catalog', 'prefetch')
+
+# A queued job counts as one class more urgent for every AGING_SECONDS it has
+# waited, so background work still runs under a steady stream of clicks
+AGING_SECONDS = float(os.getenv('GENERATION_AGING_SECONDS', '30'))
+
+# Most jobs of a class that may run in one batch (0 means no cap). Small
+# background batches finish or get preempted quickly.
+CLASS_CAPS = {
+    'interactive': int(os.getenv('GENERATION_INTERACTIVE_CAP', '0')),
+    'catalog': int(os.getenv('GENERATION_CATALOG_CAP', '0')),
+    'prefetch': int(os.getenv('GENERATION_PREFETCH_CAP', '2'))
+}
+
+# A running batch is only preempted before it is this far along, and a job is
+# never preempted more than MAX_PREEMPTIONS times
+PREEMPT_MAX_PROGRESS = float(os.getenv('GENERATION_PREEMPT_MAX_PROGRESS', '0.75'))
+MAX_PREEMPTIONS = int(os.getenv('GENERATION_MAX_PREEMPTIONS', '2'))
+
+
+def priority_rank(priority):
+    return PRIORITIES.index(priority)
+
+
+class Preempted(Exception):
+    """Raised from the step callback to stop a batch so more urgent work can run."""
+
+
+class JobQueue:
+    """Priority queue of pending generation jobs with aging and per-class caps.
+
+    The most urgent job (after aging) leads the next batch and decides its
+    settings; compatible jobs join it in the same order while their class has
+    room under its cap. ``should_preempt`` tells a running batch whether a
+    job of a strictly more urgent class is waiting that would also be taken
+    ahead of it after aging.
+    """
+
+    def __init__(self, max_batch_size, batch_wait, class_caps=None, aging_seconds=AGING_SECONDS):
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_wait = batch_wait
+        self.class_caps = CLASS_CAPS if class_caps is None else class_caps
+        self.aging_seconds = aging_seconds
+        self._pending = []
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, job):
+        with self._cond:
+            self._pending.append(job)
+            self._cond.notify()
+
+    def requeue(self, jobs):
+        """Put preempted jobs back; they keep their submission time and so their age."""
+        with self._cond:
+            for job in jobs:
+                job.started_at = None
+                job.preemptions += 1
+                self._pending.append(job)
+            self._cond.notify()
+
+    def remove(self, job):
+        """Drop a job that has not started yet. Returns False if it already left the queue."""
+        with self._cond:
+            if job not in self._pending:
+                return False
+            self._pending.remove(job)
+            return True
+
+    def promote(self, job, priority):
+        """Raise a queued job to ``priority`` if that is more urgent than its own."""
+        with self._cond:
+            if priority_rank(priority) < priority_rank(job.priority):
+                job.priority = priority
+                self._cond.notify()
+
+    def _order(self, job, now):
+        rank = priority_rank(job.priority)
+        if self.aging_seconds > 0:
+            rank -= (now - job.submitted_at) / self.aging_seconds
+        return (rank, job.submitted_at)
+
+    def ahead_of(self, job):
+        """Queued jobs that would run before ``job`` if it were queued now."""
+        now = time.time()
+        order = self._order(job, now)
+        with self._cond:
+            return [other for other in self._pending if other is not job and self._order(other, now) < order]
+
+    def _compatible(self, key, now):
+        """Pending jobs with batch key ``key`` that fit in one batch, most urgent first."""
+        batch = []
+        per_class = {}
+        for job in sorted(self._pending, key=lambda job: self._order(job, now)):
+            if job.batch_key() != key:
+                continue
+            cap = self.class_caps.get(job.priority, 0)
+            # The leader always runs, even when its class is capped at zero room
+            if batch and cap and per_class.get(job.priority, 0) >= cap:
+                continue
+            batch.append(job)
+            per_class[job.priority] = per_class.get(job.priority, 0) + 1
+            if len(batch) == self.max_batch_size:
+                break
+        return batch
+
+    def take_batch(self):
+        """Block until there is work and return the next batch of compatible jobs."""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            # Give concurrent requests a moment to arrive so they can share the call
+            key = min(self._pending, key=lambda job: self._order(job, time.time())).batch_key()
+            deadline = time.time() + self.batch_wait
+            while len(self._compatible(key, time.time())) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = self._compatible(key, time.time())
+            for job in batch:
+                self._pending.remove(job)
+            return batch
+
+    def should_preempt(self, batch, progress):
+        """Whether ``batch``, ``progress`` (0-1) of the way through, should yield the pipeline."""
+        if progress >= PREEMPT_MAX_PROGRESS:
+            return False
+        if any(job.preemptions >= MAX_PREEMPTIONS for job in batch):
+            return False
+        # Compare by aged order, as take_batch does: an aged batch that would be
+        # picked again ahead of the waiting job gains nothing from yielding
+        now = time.time()
+        running = min(priority_rank(job.priority) for job in batch)
+        running_order = min(self._order(job, now) for job in batch)
+        with self._cond:
+            return any(priority_rank(job.priority) < running and self._order(job, now) < running_order
+                       for job in self._pending)
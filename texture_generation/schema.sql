@@ -30,7 +30,8 @@ CREATE TABLE textures (
     description VARCHAR(200),
     category_id INTEGER NOT NULL REFERENCES texture_categories(id),
     preview_image_path VARCHAR(200) NOT NULL,
-    thumbnail_path VARCHAR(200) NOT NULL
+    thumbnail_path VARCHAR(200) NOT NULL,
+    generated_texture_path VARCHAR(255)
 );
 
 CREATE TABLE furniture_type_parts (
@@ -0,0 +1,87 @@
+import threading
+import metrics
+
+
+class SessionJobs:
+    """In-flight interactive generation jobs of each client session, by mask.
+
+    Users click through several textures for the same mask and only the last
+    result is shown. Tracking a new job for a mask cancels the session's
+    earlier job for it, and ending the session cancels everything still
+    running, so the pipeline stops working on results nobody will see.
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+        metrics.register_gauge('session_jobs_in_flight', lambda: len(self._jobs))
+
+    def track(self, session_id, mask, job):
+        """Record ``job`` as the session's current job for ``mask``, superseding the previous one."""
+        if not session_id:
+            return
+        with self._lock:
+            previous = self._jobs.get((session_id, mask))
+            self._jobs[(session_id, mask)] = job
+        if previous is not None and previous is not job and self.worker.cancel(previous):
+            metrics.increment('generation_superseded_jobs')
+
+    def release(self, session_id, mask, job):
+        """Forget ``job`` once its request has returned, unless it was already superseded."""
+        with self._lock:
+            if self._jobs.get((session_id, mask)) is job:
+                del self._jobs[(session_id, mask)]
+
+    def end_session(self, session_id):
+        """Cancel every job the session still has in flight."""
+        with self._lock:
+            keys = [key for key in self._jobs if key[0] == session_id]
+            jobs = [self._jobs.pop(key) for key in keys]
+        for job in jobs:
+            self.worker.cancel(job)
+
+
+class SessionTextures:
+    """Photo uploaded by each session and the texture files applied to its masks.
+
+    Updated whenever a generate or recolor request for a mask succeeds, so
+    endpoints like the atlas and the composite can work from what the user
+    actually sees. A new upload starts over with no textures applied.
+    """
+
+    def __init__(self):
+        self._textures = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+        metrics.register_gauge('session_textures_sessions', lambda: len(self._textures))
+
+    def start_upload(self, session_id, upload_id):
+        if not session_id:
+            return
+        with self._lock:
+            self._uploads[session_id] = upload_id
+            self._textures.pop(session_id, None)
+
+    def upload(self, session_id):
+        """Id of the session's current upload, if any."""
+        with self._lock:
+            return self._uploads.get(session_id)
+
+    def apply(self, session_id, mask, texture_path):
+        if not session_id or not texture_path:
+            return
+        with self._lock:
+            self._textures.setdefault(session_id, {})[mask] = texture_path
+
+    def get(self, session_id):
+        """``{mask: texture_path}`` for the session."""
+        with self._lock:
+            return dict(self._textures.get(session_id, {}))
+
+    def end_session(self, session_id):
+        with self._lock:
+            self._textures.pop(session_id, None)
+            self._uploads.pop(session_id, None)
@@ -0,0 +1,49 @@
+import os
+
+# Stable Diffusion works on 8x downsampled latents and its UNet halves them
+# three more times, so generation sizes are kept on multiples of 64.
+SIZE_MULTIPLE = 64
+MIN_GENERATION_SIZE = int(os.getenv('GENERATION_MIN_SIZE', '128'))
+
+# Largest texture produced for a single mask after upscaling
+MAX_OUTPUT_SIZE = int(os.getenv('GENERATION_MAX_OUTPUT_SIZE', '2048'))
+
+
+def mask_bbox(points):
+    """Bounding box ``(min_x, min_y, max_x, max_y)`` of a mask polygon."""
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def snap_size(value, max_size):
+    """Round ``value`` to a multiple of 64 between the minimum generation size and ``max_size``."""
+    snapped = int(round(value / SIZE_MULTIPLE)) * SIZE_MULTIPLE
+    return max(min(snapped, max_size), min(MIN_GENERATION_SIZE, max_size))
+
+
+def region_sizes(region_width, region_height, max_size):
+    """Generation and output sizes for a region of the given pixel size.
+
+    Returns ``(width, height, output_width, output_height)``. The generation
+    size keeps the region's aspect ratio, is snapped to multiples of 64 and
+    never exceeds ``max_size`` on either side. Thin regions are scaled up as a
+    whole until their short side reaches the minimum generation size, so only
+    the cap on the long side can flatten their ratio. Regions larger than
+    ``max_size`` are generated at the capped size and upscaled to the region
+    size (itself capped at MAX_OUTPUT_SIZE).
+    """
+    region_width = max(region_width, 1)
+    region_height = max(region_height, 1)
+
+    scale = min(1.0, max_size / max(region_width, region_height))
+    min_size = min(MIN_GENERATION_SIZE, max_size)
+    if min(region_width, region_height) * scale < min_size:
+        scale = min_size / min(region_width, region_height)
+    width = snap_size(region_width * scale, max_size)
+    height = snap_size(region_height * scale, max_size)
+    if max(region_width, region_height) <= max_size:
+        return width, height, width, height
+
+    output_scale = min(1.0, MAX_OUTPUT_SIZE / max(region_width, region_height))
+    return width, height, int(round(region_width * output_scale)), int(round(region_height * output_scale))
@@ -0,0 +1,34 @@
+import numpy as np
+import torch
+
+
+def set_circular_padding(pipe, enabled):
+    """Switch every UNet and VAE convolution between circular and zero padding.
+
+    With circular padding the left/right and top/bottom edges of the latent
+    and of the decoded image see each other, so the output tiles seamlessly.
+    """
+    padding_mode = 'circular' if enabled else 'zeros'
+    for model in (pipe.unet, pipe.vae):
+        for module in model.modules():
+            if isinstance(module, torch.nn.Conv2d):
+                module.padding_mode = padding_mode
+
+
+def seam_error(image):
+    """How visible the seams are when ``image`` is tiled.
+
+    Compares the pixel step across the wrap-around edges with the average
+    step between neighbouring pixels inside the image. A seamless tile scores
+    about 1.0; hard seams score well above it.
+    """
+    pixels = np.asarray(image, dtype=np.float32)
+    interior = np.concatenate([
+        np.abs(np.diff(pixels, axis=0)).ravel(),
+        np.abs(np.diff(pixels, axis=1)).ravel()
+    ]).mean()
+    seams = np.concatenate([
+        np.abs(pixels[0] - pixels[-1]).ravel(),
+        np.abs(pixels[:, 0] - pixels[:, -1]).ravel()
+    ]).mean()
+    return float(seams / max(interior, 1e-6))
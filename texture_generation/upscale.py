@@ -0,0 +1,62 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Upscaler used after low-resolution diffusion, and the number of CPU threads
+# post-processing runs on while the worker moves on to the next batch
+UPSCALER = os.getenv('GENERATION_UPSCALER', 'lanczos')
+UPSCALE_WORKERS = int(os.getenv('GENERATION_UPSCALE_WORKERS', '2'))
+
+# Optional OpenCV super-resolution model (e.g. FSRCNN_x2.pb), used by the
+# 'superres' upscaler. Requires opencv-contrib-python.
+SUPERRES_MODEL_PATH = os.getenv('GENERATION_SUPERRES_MODEL', '')
+
+_upscalers = {}
+_superres = None
+_superres_lock = threading.Lock()
+
+# Shared pool for CPU post-processing of generated images
+upscale_pool = ThreadPoolExecutor(max_workers=max(1, UPSCALE_WORKERS), thread_name_prefix='upscale')
+
+
+def register_upscaler(name, upscaler):
+    """Register ``upscaler(image, size) -> image`` under ``name``."""
+    _upscalers[name] = upscaler
+
+
+def get_upscaler(name=None):
+    name = name or UPSCALER
+    if name not in _upscalers:
+        raise ValueError(f"Unknown upscaler: {name}")
+    return _upscalers[name]
+
+
+def lanczos_unsharp(image, size):
+    """Lanczos resize followed by a light unsharp mask to restore edge contrast."""
+    resized = image.resize(size, Image.LANCZOS)
+    if size[0] <= image.width and size[1] <= image.height:
+        return resized
+    return resized.filter(ImageFilter.UnsharpMask(radius=2, percent=60, threshold=2))
+
+
+def superres(image, size):
+    """Upscale with an OpenCV dnn_superres model, then resize to the exact size."""
+    global _superres
+    import cv2
+    with _superres_lock:
+        if _superres is None:
+            # Model files are named like FSRCNN_x2.pb: algorithm and scale factor
+            name, scale = os.path.splitext(os.path.basename(SUPERRES_MODEL_PATH))[0].split('_x')
+            model = cv2.dnn_superres.DnnSuperResImpl_create()
+            model.readModel(SUPERRES_MODEL_PATH)
+            model.setModel(name.lower(), int(scale))
+            _superres = model
+        upscaled = _superres.upsample(np.asarray(image.convert('RGB'))[:, :, ::-1])
+    return Image.fromarray(np.ascontiguousarray(upscaled[:, :, ::-1])).resize(size, Image.LANCZOS)
+
+
+register_upscaler('lanczos', lanczos_unsharp)
+if SUPERRES_MODEL_PATH:
+    register_upscaler('superres', superres)